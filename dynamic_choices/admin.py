@@ -1,6 +1,11 @@
 from __future__ import unicode_literals
 
+import hashlib
 import json
+import re
+import types
+import zlib
+from copy import copy
 from functools import update_wrapper
 
 import django
@@ -11,17 +16,28 @@ from django.db import models
 from django.db.models.constants import LOOKUP_SEP
 from django.forms.models import ModelForm, _get_foreign_key, model_to_dict
 from django.forms.widgets import Select, SelectMultiple
-from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotModified,
+    StreamingHttpResponse,
+)
 from django.template.defaultfilters import escape
-from django.utils.encoding import force_text
+from django.utils.cache import (
+    add_never_cache_headers, patch_cache_control, patch_vary_headers,
+)
+from django.utils.encoding import force_bytes, force_text
 from django.utils.functional import Promise
+from django.utils.http import parse_etags, quote_etag
 from django.utils.safestring import SafeText
 from django.utils.six import with_metaclass
 from django.utils.six.moves import range
+from django.utils.text import compress_sequence, compress_string
+from django.utils.translation import get_language
 
+from .db.dependencies import get_dependency_graph
+from .db.query import identity_map
 from .forms import DynamicModelForm, dynamic_model_form_factory
 from .forms.fields import DynamicModelChoiceField
-from .utils import template_extends
+from .utils import get_cache, template_extends
 
 
 class LazyEncoder(json.JSONEncoder):
@@ -32,14 +48,27 @@ class LazyEncoder(json.JSONEncoder):
 
 lazy_encoder = LazyEncoder()
 
+# Approximate number of characters of the chunks of streamed choices.
+STREAM_CHUNK_SIZE = 64 * 1024
+# Maximum number of choices per segment of streamed compact choices.
+STREAM_SEGMENT_SIZE = 1000
 
-def get_dynamic_choices_from_form(form):
+
+def get_dynamic_choices_from_form(form, names=None, choices=None, stream=False):
+    """
+    Return the choices of the form's dynamic fields, only the specified
+    prefixed names are evaluated if provided. Already evaluated choices
+    can be provided by field name. When stream is true the choices are
+    lazy iterators fetching them as they're consumed.
+    """
     fields = {}
     if form.prefix:
         prefix = "%s-%s" % (form.prefix, '%s')
     else:
         prefix = '%s'
     for name, field in form.fields.items():
+        if names is not None and prefix % name not in names:
+            continue
         if isinstance(field, DynamicModelChoiceField):
             widget_cls = field.widget.widget.__class__
             if widget_cls in (Select, SelectMultiple):
@@ -49,11 +78,211 @@ def get_dynamic_choices_from_form(form):
                                     widget_cls.__name__)
             fields[prefix % name] = {
                 'widget': widget,
-                'value': list(field.widget.choices)
+                'value': choices[name] if choices is not None else (
+                    field.iter_choices() if stream else list(field.widget.choices)
+                )
             }
     return fields
 
 
+def get_cascaded_dynamic_choices_from_form(form, names, stream=False, checked=()):
+    """
+    Return the choices of the form's dynamic fields matching the specified
+    prefixed names and of the ones depending on them transitively along
+    with the names of the fields whose value isn't a valid choice anymore.
+    See DynamicModelForm.get_cascaded_dynamic_choices for stream and checked.
+    """
+    choices, invalidated = form.get_cascaded_dynamic_choices(
+        [name for name in form.fields if form.add_prefix(name) in names], stream, checked
+    )
+    names = set(form.add_prefix(name) for name in choices)
+    return get_dynamic_choices_from_form(form, names, choices), invalidated
+
+
+def _indexer(table):
+    """Return a function returning the index of a value in table, appending it if missing."""
+    indexes = {}
+
+    def index(value):
+        try:
+            return indexes[value]
+        except KeyError:
+            table.append(value)
+            index = indexes[value] = len(table) - 1
+            return index
+    return index
+
+
+def _is_group(label):
+    return isinstance(label, (list, tuple, types.GeneratorType))
+
+
+def _iter_compact_segments(choices, group_index, size=None):
+    """
+    Yield the compact segments of choices holding at most size choices,
+    segments continuing the previous group have a fourth truthy item.
+    """
+    ungrouped = None
+    for value, label in choices:
+        if _is_group(label):
+            if ungrouped is not None:
+                yield ungrouped
+                ungrouped = None
+            segment = [group_index(force_text(value)), [], []]
+            for choice, choice_label in label:
+                if size and len(segment[1]) >= size:
+                    yield segment
+                    segment = [segment[0], [], [], 1]
+                segment[1].append(choice)
+                segment[2].append(choice_label)
+            yield segment
+        else:
+            if ungrouped is None:
+                ungrouped = [-1, [], []]
+            elif size and len(ungrouped[1]) >= size:
+                yield ungrouped
+                ungrouped = [-1, [], []]
+            ungrouped[1].append(value)
+            ungrouped[2].append(label)
+    if ungrouped is not None:
+        yield ungrouped
+
+
+def encode_compact_choices(data):
+    """
+    Return the compact form of the dynamic choices data returned by
+    get_dynamic_choices_from_form.
+
+    Widget names and group labels are deduplicated in the widgets and groups
+    lists and the choices of each field are sent as segments of parallel
+    values and labels lists along with the index of their group, -1 for
+    ungrouped ones.
+    """
+    widgets, groups = [], []
+    widget_index, group_index = _indexer(widgets), _indexer(groups)
+    fields = {}
+    for name, field in data.items():
+        fields[name] = [widget_index(field['widget']), list(_iter_compact_segments(field['value'], group_index))]
+    return {'widgets': widgets, 'groups': groups, 'fields': fields}
+
+
+def _iter_choices_json(data):
+    encode = lazy_encoder.encode
+    yield '{'
+    for index, (name, field) in enumerate(data.items()):
+        yield '%s%s: {"widget": %s, "value": [' % (', ' if index else '', encode(name), encode(field['widget']))
+        for choice_index, (value, label) in enumerate(field['value']):
+            separator = ', ' if choice_index else ''
+            if _is_group(label):
+                yield '%s[%s, [' % (separator, encode(value))
+                for group_index, choice in enumerate(label):
+                    yield '%s%s' % (', ' if group_index else '', encode(list(choice)))
+                yield ']]'
+            else:
+                yield '%s%s' % (separator, encode([value, label]))
+        yield ']}'
+    yield '}'
+
+
+def _iter_compact_choices_json(data, size):
+    encode = lazy_encoder.encode
+    widgets, groups = [], []
+    widget_index, group_index = _indexer(widgets), _indexer(groups)
+    # Deduplication tables are only complete once every field is written.
+    yield '{"fields": {'
+    for index, (name, field) in enumerate(data.items()):
+        yield '%s%s: [%d, [' % (', ' if index else '', encode(name), widget_index(field['widget']))
+        for segment_index, segment in enumerate(_iter_compact_segments(field['value'], group_index, size)):
+            yield '%s%s' % (', ' if segment_index else '', encode(segment))
+        yield ']]'
+    yield '}, "widgets": %s, "groups": %s}' % (encode(widgets), encode(groups))
+
+
+def iter_dynamic_choices_json(data, compact=False, chunk_size=STREAM_CHUNK_SIZE, segment_size=STREAM_SEGMENT_SIZE):
+    """
+    Yield the JSON encoding, compact or not, of dynamic choices data by
+    chunks of about chunk_size characters. Choices are iterated over, and
+    thus fetched, as they're encoded.
+    """
+    if compact:
+        pieces = _iter_compact_choices_json(data, segment_size)
+    else:
+        pieces = _iter_choices_json(data)
+    chunk, length = [], 0
+    for piece in pieces:
+        chunk.append(piece)
+        length += len(piece)
+        if length >= chunk_size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def _compress_sequence(sequence):
+    compressor = zlib.compressobj()
+    for item in sequence:
+        data = compressor.compress(force_bytes(item))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepts_encoding(request, encoding):
+    for accepted in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = accepted.strip().split(';')
+        if params[0].strip().lower() in (encoding, '*'):
+            match = re.match(r'^\s*q\s*=\s*([\d.]+)\s*$', params[1]) if len(params) > 1 else None
+            try:
+                return match is None or float(match.group(1)) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def _weaken_etag(response):
+    # The compressed body isn't byte-for-byte the one the ETag was computed on
+    etag = response.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response['ETag'] = 'W/%s' % etag
+
+
+def compress_response(request, response):
+    """
+    Compress the content of response with gzip or deflate if accepted by
+    request and worth it.
+    """
+    if response.status_code != 200 or response.has_header('Content-Encoding'):
+        return response
+    if response.streaming:
+        patch_vary_headers(response, ('Accept-Encoding',))
+        for encoding, compress in (('gzip', compress_sequence), ('deflate', _compress_sequence)):
+            if _accepts_encoding(request, encoding):
+                response.streaming_content = compress(response.streaming_content)
+                response['Content-Encoding'] = encoding
+                _weaken_etag(response)
+                break
+        return response
+    if len(response.content) < 200:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    for encoding, compress in (('gzip', compress_string), ('deflate', zlib.compress)):
+        if _accepts_encoding(request, encoding):
+            content = compress(response.content)
+            if len(content) < len(response.content):
+                response.content = content
+                response['Content-Encoding'] = encoding
+                response['Content-Length'] = str(len(content))
+                _weaken_etag(response)
+            break
+    return response
+
+
+def get_request_data(request):
+    """Return the data submitted along request."""
+    return request.POST if request.method == 'POST' else request.GET
+
+
 def dynamic_formset_factory(fieldset_cls, initial):
     class cls(fieldset_cls):
         def __init__(self, *args, **kwargs):
@@ -143,6 +372,12 @@ def dynamic_admin_factory(admin_cls):
             return super(meta_cls, cls).__new__(cls, name, bases, attrs)
 
     class cls(with_metaclass(meta_cls, admin_cls)):
+        # Number of seconds choices responses are cached for, None disables caching
+        dynamic_choices_cache_timeout = None
+        dynamic_choices_cache_alias = 'default'
+        # Whether or not uncached choices responses are streamed
+        dynamic_choices_stream = False
+
         def _media(self):
             media = super(cls, self).media
             media.add_js(('js/dynamic-choices.js',
@@ -151,16 +386,16 @@ def dynamic_admin_factory(admin_cls):
         media = property(_media)
 
         def get_urls(self):
-            def wrap(view):
+            def wrap(view, cacheable=False):
                 def wrapper(*args, **kwargs):
-                    return self.admin_site.admin_view(view)(*args, **kwargs)
+                    return self.admin_site.admin_view(view, cacheable)(*args, **kwargs)
                 return update_wrapper(wrapper, view)
 
             info = self.model._meta.app_label, self.model._meta.model_name
 
             urlpatterns = [
                 url(r'(?:add|(?P<object_id>\w+))/choices/$',
-                    wrap(self.dynamic_choices),
+                    wrap(self.dynamic_choices, cacheable=True),
                     name="%s_%s_dynamic_admin" % info),
             ] + super(cls, self).get_urls()
 
@@ -174,85 +409,315 @@ def dynamic_admin_factory(admin_cls):
             def inline_field_selector(fieldset, field):
                 return "[name^='%s-'][name$='-%s']" % (fieldset, field)
 
+            def form_field_names(form_cls):
+                dynamic_names = frozenset(
+                    name for name, field in form_cls.base_fields.items() if isinstance(field, DynamicModelChoiceField)
+                )
+                return frozenset(form_cls.base_fields), dynamic_names
+
+            # Use get_form in order to allow formfield override, the binder
+            # only depends on the fields of the forms and is cached based on them.
+            form_names = form_field_names(self.get_form(request))
+            formsets = tuple(
+                (formset.get_default_prefix(), formset.model, getattr(getattr(formset, 'fk', None), 'name', None),
+                 form_field_names(formset.form))
+                for formset, _inline in self.get_formsets_with_inlines(request)
+            )
+            key = (form_names, formsets)
+            try:
+                binders = self._dynamic_choices_binders
+            except AttributeError:
+                binders = self._dynamic_choices_binders = {}
+            try:
+                return binders[key]
+            except KeyError:
+                pass
+
             fields = {}
 
             def add_fields(to_fields, to_field, bind_fields):
-                if not (to_field in to_fields):
-                    to_fields[to_field] = set()
-                to_fields[to_field].update(bind_fields)
-
-            model_name = self.model._meta.model_name
-
-            # Use get_form in order to allow formfield override
-            # We should create a fake request from referer but all this
-            # hack will be fixed when the code is embed directly in the page
-            form = self.get_form(request)()
-            rels = form.get_dynamic_relationships()
-            for rel in rels:
-                field_name = rel.split(LOOKUP_SEP)[0]
-                if rel in form.fields:
-                    add_fields(fields, id(field_name), [id(field) for field in rels[rel] if field in form.fields])
+                if bind_fields:
+                    to_fields.setdefault(to_field, set()).update(bind_fields)
+
+            form_fields, form_dynamic_fields = form_names
+            for name, dependents in get_dependency_graph(self.model).dependents.items():
+                if name in form_fields:
+                    add_fields(fields, id(name), [id(field) for field in dependents if field in form_dynamic_fields])
 
             inlines = {}
-            for formset, _inline in self.get_formsets_with_inlines(request):
+            for prefix, model, fk_name, (formset_fields, formset_dynamic_fields) in formsets:
                 inline = {}
-                formset_form = formset.form()
-                inline_rels = formset_form.get_dynamic_relationships()
-                prefix = formset.get_default_prefix()
-                for rel in inline_rels:
-                    if LOOKUP_SEP in rel:
-                        base, field = rel.split(LOOKUP_SEP)[0:2]
-                        if base == model_name and field in form.fields:
-                            bound_fields = [
-                                inline_field_selector(prefix, f)
-                                for f in inline_rels[rel] if f in formset_form.fields
-                            ]
-                            add_fields(fields, id(field), bound_fields)
-                        elif base in formset_form.fields:
-                            add_fields(inline, base, inline_rels[rel])
-                    elif rel in formset_form.fields:
-                        add_fields(inline, rel, inline_rels[rel])
-                if len(inline):
+                graph = get_dependency_graph(model)
+                # Bind the parent fields the inline fields depend on
+                if fk_name is not None:
+                    for name, dependents in graph.get_related_dependents(fk_name).items():
+                        if name in form_fields:
+                            add_fields(fields, id(name), [
+                                inline_field_selector(prefix, field)
+                                for field in dependents if field in formset_dynamic_fields
+                            ])
+                for name, dependents in graph.dependents.items():
+                    if name != fk_name and name in formset_fields:
+                        add_fields(inline, name, [field for field in dependents if field in formset_dynamic_fields])
+                if inline:
                     inlines[prefix] = inline
 
             # Replace sets in order to allow JSON serialization
             for field, bound_fields in fields.items():
-                fields[field] = list(bound_fields)
+                fields[field] = sorted(bound_fields)
 
             for fieldset, inline_fields in inlines.items():
                 for field, bound_fields in inline_fields.items():
-                    inlines[fieldset][field] = list(bound_fields)
-
-            return SafeText("django.dynamicAdmin(%s, %s);" % (json.dumps(fields), json.dumps(inlines)))
-
-        def dynamic_choices(self, request, object_id=None):
-
+                    inlines[fieldset][field] = sorted(bound_fields)
+
+            def row_inputs(prefix, model, fk_name, formset_fields, names, selector):
+                """Return the inputs the specified fields of inline rows are evaluated from."""
+                graph = get_dependency_graph(model)
+                inputs = set([
+                    id('%s-TOTAL_FORMS' % prefix), id('%s-INITIAL_FORMS' % prefix), selector(model._meta.pk.name)
+                ])
+                for name in names:
+                    for descriptor in graph.fields.get(name, ()):
+                        lookups = descriptor.split(LOOKUP_SEP)
+                        if lookups[0] == fk_name:
+                            if len(lookups) > 1 and lookups[1] in form_fields:
+                                inputs.add(id(lookups[1]))
+                        elif lookups[0] in formset_fields:
+                            inputs.add(selector(lookups[0]))
+                return inputs
+
+            # Inputs the choices of every dynamic field, and of the ones
+            # depending on them transitively, are evaluated from.
+            inputs = {'fields': {}, 'inlines': {}}
+            graph = get_dependency_graph(self.model)
+            for name in form_dynamic_fields:
+                evaluated = (graph.closure.get(name, frozenset()) | set([name])) & form_dynamic_fields
+                field_inputs = set()
+                for field in evaluated:
+                    field_inputs.update(id(requirement) for requirement in graph.requirements.get(field, ())
+                                        if requirement in form_fields)
+                # Inline fields depending on evaluated fields are evaluated for every row
+                for prefix, model, fk_name, (formset_fields, formset_dynamic_fields) in formsets:
+                    if fk_name is None:
+                        continue
+                    formset_graph = get_dependency_graph(model)
+                    row_fields = set()
+                    for field, dependents in formset_graph.get_related_dependents(fk_name).items():
+                        if field in evaluated:
+                            row_fields.update(dependents)
+                    for field in list(row_fields):
+                        row_fields.update(formset_graph.closure.get(field, ()))
+                    row_fields &= formset_dynamic_fields
+                    if row_fields:
+                        field_inputs.update(row_inputs(
+                            prefix, model, fk_name, formset_fields, row_fields,
+                            lambda field: inline_field_selector(prefix, field)
+                        ))
+                inputs['fields'][name] = sorted(field_inputs)
+
+            for prefix, model, fk_name, (formset_fields, formset_dynamic_fields) in formsets:
+                formset_graph = get_dependency_graph(model)
+                inline_inputs = inputs['inlines'][prefix] = {}
+                for name in formset_dynamic_fields:
+                    evaluated = (formset_graph.closure.get(name, frozenset()) | set([name])) & formset_dynamic_fields
+                    inline_inputs[name] = sorted(row_inputs(
+                        prefix, model, fk_name, formset_fields, evaluated,
+                        lambda field: id('%s-{index}-%s' % (prefix, field))
+                    ))
+
+            binder = binders[key] = SafeText("django.dynamicAdmin(%s, %s, %s);" % (
+                json.dumps(fields, sort_keys=True), json.dumps(inlines, sort_keys=True),
+                json.dumps(inputs, sort_keys=True)
+            ))
+            return binder
+
+        def get_dynamic_choices_cache_key(self, request, object_id=None):
+            """
+            Return the cache key of a choices response which depends on the
+            requested fields, their relationship values, the user permissions
+            and the active language labels are translated in.
+            """
+            user = request.user
+            # Superusers are granted every permission
+            permissions = None if user.is_superuser else sorted(user.get_all_permissions())
             opts = self.model._meta
-            obj = self.get_object(request, object_id)
-            # Make sure the specified object exists
-            if object_id is not None and obj is None:
-                raise Http404('%(name)s object with primary key %(key)r does not exist.' % {
-                              'name': force_text(opts.verbose_name), 'key': escape(object_id)})
-
-            form = self.get_form(request)(request.GET, instance=obj)
-            data = get_dynamic_choices_from_form(form)
+            data = [item for item in get_request_data(request).lists() if item[0] != 'csrfmiddlewaretoken']
+            key = json.dumps([object_id, sorted(data), permissions, get_language()])
+            return "dynamic_choices.%s.%s.%s" % (
+                opts.app_label, opts.model_name, hashlib.md5(force_bytes(key)).hexdigest()
+            )
 
-            for formset, _inline in self.get_formsets_with_inlines(request, obj):
-                prefix = formset.get_default_prefix()
-                try:
-                    fs = formset(request.GET, instance=obj)
-                    forms = fs.forms + [fs.empty_form]
-                except ValidationError:
-                    return HttpResponseBadRequest("Missing %s ManagementForm data" % prefix)
-                for form in forms:
-                    data.update(get_dynamic_choices_from_form(form))
-
-            if 'DYNAMIC_CHOICES_FIELDS' in request.GET:
-                fields = request.GET.get('DYNAMIC_CHOICES_FIELDS').split(',')
-                for field in list(data):
-                    if field not in fields:
-                        del data[field]
+        def dynamic_choices(self, request, object_id=None):
+            return compress_response(request, self._cached_dynamic_choices(request, object_id))
+
+        def _cached_dynamic_choices(self, request, object_id=None):
+            timeout = self.dynamic_choices_cache_timeout
+            if timeout is None:
+                response = self._dynamic_choices(request, object_id, stream=self.dynamic_choices_stream)
+                add_never_cache_headers(response)
+                return response
+            cache = get_cache(self.dynamic_choices_cache_alias)
+            key = self.get_dynamic_choices_cache_key(request, object_id)
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            cached = cache.get(key)
+            if cached is None:
+                response = self._dynamic_choices(request, object_id)
+                if response.status_code != 200:
+                    return response
+                etag = hashlib.md5(response.content).hexdigest()
+                cache.set(key, (etag, response.content), timeout)
+            else:
+                etag, content = cached
+                response = HttpResponse(content, content_type='application/json')
+            if etag in etags:
+                response = HttpResponseNotModified()
+            response['ETag'] = quote_etag(etag)
+            # Make sure the browser revalidates the response on every request
+            patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+            return response
+
+        def _dynamic_choices(self, request, object_id=None, stream=False):
+            with identity_map():
+                opts = self.model._meta
+                obj = self.get_object(request, object_id)
+                # Make sure the specified object exists
+                if object_id is not None and obj is None:
+                    raise Http404('%(name)s object with primary key %(key)r does not exist.' % {
+                                  'name': force_text(opts.verbose_name), 'key': escape(object_id)})
+
+                # Choices are requested through POST when their inputs are too large
+                query = get_request_data(request)
+
+                if 'DYNAMIC_CHOICES_SEARCH' in query:
+                    return self._search_dynamic_choices(request, obj, query, query.get('DYNAMIC_CHOICES_SEARCH'))
+
+                # Only evaluate the requested fields if specified
+                names = None
+                cascade = False
+                if 'DYNAMIC_CHOICES_FIELDS' in query:
+                    names = set(query.get('DYNAMIC_CHOICES_FIELDS').split(','))
+                    # Evaluate the fields depending on them transitively as well
+                    cascade = 'DYNAMIC_CHOICES_CASCADE' in query
+
+                data = {}
+                cascaded = ()
+                if names is None or any('-' not in name for name in names):
+                    form = self.get_form(request)(query, instance=obj)
+                    if cascade:
+                        fields, invalidated = get_cascaded_dynamic_choices_from_form(
+                            form, names, stream, self._get_inline_requirements(request, obj) if stream else ()
+                        )
+                        data.update(fields)
+                        cascaded = set(fields)
+                        if invalidated:
+                            # Make sure inlines see invalidated values as if they were submitted empty
+                            request = copy(request)
+                            query = query.copy()
+                            for name in invalidated:
+                                query[name] = ''
+                            setattr(request, request.method, query)
+                    else:
+                        data.update(get_dynamic_choices_from_form(form, names, stream=stream))
 
+                for formset, _inline in self.get_formsets_with_inlines(request, obj):
+                    prefix = formset.get_default_prefix()
+                    if names is not None:
+                        # Collect the indexes of the requested rows
+                        indexes = set()
+                        for name in names:
+                            if name.startswith(prefix + '-'):
+                                indexes.add(name[len(prefix) + 1:].split('-', 1)[0])
+                        # Collect the fields depending on the cascaded ones
+                        dependents = set()
+                        fk = getattr(formset, 'fk', None)
+                        if cascaded and fk is not None:
+                            graph = get_dependency_graph(formset.model)
+                            for name, fields in graph.get_related_dependents(fk.name).items():
+                                if name in cascaded:
+                                    dependents.update(fields)
+                        # Skip formsets that contribute no requested field
+                        if not indexes and not dependents:
+                            continue
+                    try:
+                        fs = formset(query, instance=obj)
+                        if names is None:
+                            forms = fs.forms + [fs.empty_form]
+                        else:
+                            # Only build the requested rows
+                            forms = []
+                            total_form_count = fs.total_form_count()
+                            if dependents:
+                                # Cascade to every row
+                                for index in ['__prefix__'] + [str(index) for index in range(total_form_count)]:
+                                    indexes.add(index)
+                                    names.update("%s-%s" % (fs.add_prefix(index), field) for field in dependents)
+                            for index in indexes:
+                                if index == '__prefix__':
+                                    forms.append(fs.empty_form)
+                                elif index.isdigit() and int(index) < total_form_count:
+                                    forms.append(fs._construct_form(int(index)))
+                    except ValidationError:
+                        return HttpResponseBadRequest("Missing %s ManagementForm data" % prefix)
+                    for form in forms:
+                        if cascade:
+                            data.update(get_cascaded_dynamic_choices_from_form(form, names, stream)[0])
+                        else:
+                            data.update(get_dynamic_choices_from_form(form, names, stream=stream))
+
+                compact = query.get('DYNAMIC_CHOICES_FORMAT') == 'compact'
+                if stream:
+                    return StreamingHttpResponse(
+                        iter_dynamic_choices_json(data, compact), content_type='application/json'
+                    )
+
+                if compact:
+                    data = encode_compact_choices(data)
+
+                return HttpResponse(lazy_encoder.encode(data), content_type='application/json')
+
+        def _get_inline_requirements(self, request, obj=None):
+            """Return the names of the fields inline dynamic fields depend on."""
+            names = set()
+            for inline in self.get_inline_instances(request, obj):
+                fk = _get_foreign_key(self.model, inline.model, fk_name=inline.fk_name)
+                names.update(get_dependency_graph(inline.model).get_related_dependents(fk.name))
+            return names
+
+        def _search_dynamic_choices(self, request, obj, query, name):
+            """
+            Return a page of the choices of the searchable field with the
+            specified prefixed name matching the searched term.
+            """
+            form = None
+            if '-' not in name:
+                form = self.get_form(request)(query, instance=obj)
+            else:
+                for formset, _inline in self.get_formsets_with_inlines(request, obj):
+                    prefix = formset.get_default_prefix()
+                    if not name.startswith(prefix + '-'):
+                        continue
+                    index = name[len(prefix) + 1:].split('-', 1)[0]
+                    try:
+                        fs = formset(query, instance=obj)
+                        if index == '__prefix__':
+                            form = fs.empty_form
+                        elif index.isdigit() and int(index) < fs.total_form_count():
+                            form = fs._construct_form(int(index))
+                    except ValidationError:
+                        return HttpResponseBadRequest("Missing %s ManagementForm data" % prefix)
+                    break
+            field = None
+            if form is not None:
+                field = form.fields.get(name[len(form.prefix) + 1:] if form.prefix else name)
+            if not isinstance(field, DynamicModelChoiceField) or not field.searchable:
+                return HttpResponseBadRequest("%s is not a searchable dynamic choices field" % name)
+            try:
+                choices, cursor = field.search_choices(
+                    query.get('DYNAMIC_CHOICES_TERM', ''), query.get('DYNAMIC_CHOICES_CURSOR') or None
+                )
+            except ValidationError:
+                return HttpResponseBadRequest("Invalid cursor")
+            data = {'choices': choices, 'cursor': cursor}
             return HttpResponse(lazy_encoder.encode(data), content_type='application/json')
 
         if django.VERSION >= (1, 7):
@@ -274,7 +739,7 @@ def dynamic_admin_factory(admin_cls):
             initial = {}
             model = self.model
             opts = model._meta
-            data = getattr(request, request.method).items()
+            data = get_request_data(request).items()
             # If an object is provided we collect data
             if obj is not None:
                 initial.update(model_to_dict(obj))
@@ -307,12 +772,14 @@ def dynamic_admin_factory(admin_cls):
         def add_view(self, request, form_url='', extra_context=None):
             context = {'dynamic_choices_binder': self.get_dynamic_choices_binder(request)}
             context.update(extra_context or {})
-            return super(cls, self).add_view(request, form_url='', extra_context=context)
+            with identity_map():
+                return super(cls, self).add_view(request, form_url='', extra_context=context)
 
         def change_view(self, request, object_id, extra_context=None):
             context = {'dynamic_choices_binder': self.get_dynamic_choices_binder(request)}
             context.update(extra_context or {})
-            return super(cls, self).change_view(request, object_id, extra_context=context)
+            with identity_map():
+                return super(cls, self).change_view(request, object_id, extra_context=context)
 
     return cls
 
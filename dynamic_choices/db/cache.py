@@ -0,0 +1,134 @@
+from __future__ import unicode_literals
+
+import hashlib
+import json
+import uuid
+
+from django.db.models.base import Model
+from django.db.models.fields import Field
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils.encoding import force_bytes, force_text
+
+from ..utils import get_cache, get_models
+from .query import CompositeQuerySet
+
+# Alias of the cache choices are stored in.
+CACHE_ALIAS = 'default'
+
+
+def _normalize(value):
+    if isinstance(value, Field):
+        return [force_text(value.model._meta), value.name]
+    if isinstance(value, Model):
+        return [force_text(value._meta), value.pk]
+    if isinstance(value, type):
+        return "%s.%s" % (value.__module__, value.__name__)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_normalize(item) for item in value), key=repr)
+    return value
+
+
+def make_key(kind, parts):
+    """Return the cache key of the kind of choices identified by parts."""
+    digest = hashlib.md5(force_bytes(json.dumps(_normalize(parts), default=force_text))).hexdigest()
+    return "dynamic_choices.%s.%s" % (kind, digest)
+
+
+def _version_key(table):
+    return "dynamic_choices.version.%s" % table
+
+
+def get_tables(queryset):
+    """Return the tables queryset reads from, joined ones included."""
+    if isinstance(queryset, CompositeQuerySet):
+        querysets = queryset.querysets
+    else:
+        querysets = [queryset]
+    tables = set()
+    for qs in querysets:
+        # Joins are only setup once the query is compiled.
+        query = qs.query.clone()
+        try:
+            query.get_compiler(qs.db).as_sql()
+        except EmptyResultSet:
+            pass
+        tables.add(query.model._meta.db_table)
+        tables.update(join.table_name for join in query.alias_map.values())
+    return tables
+
+
+def _get_versions(cache, tables):
+    connect_signals(tables)
+    keys = dict((_version_key(table), table) for table in tables)
+    versions = cache.get_many(list(keys))
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[key] = cache.get(key)
+    return tuple(sorted((keys[key], version) for key, version in versions.items()))
+
+
+def cached(key, queryset, func, timeout):
+    """
+    Return the value computed by func from queryset cached under key
+    for timeout seconds.
+
+    Cached values are stored along the version of the tables queryset
+    reads from and are discarded once one of them is invalidated.
+    """
+    cache = get_cache(CACHE_ALIAS)
+    entry = cache.get(key)
+    if entry is not None:
+        versions, value = entry
+        # Entries might have been cached by another process
+        connect_signals(table for table, _version in versions)
+        current = cache.get_many([_version_key(table) for table, _version in versions])
+        if all(current.get(_version_key(table)) == version for table, version in versions):
+            return value
+    versions = _get_versions(cache, get_tables(queryset))
+    value = func()
+    cache.set(key, (versions, value), timeout)
+    return value
+
+
+def _get_model_tables(model):
+    tables = set([model._meta.db_table])
+    tables.update(parent._meta.db_table for parent in model._meta.get_parent_list())
+    return tables
+
+
+def invalidate(model):
+    """Invalidate the cached choices reading from the tables of model."""
+    get_cache(CACHE_ALIAS).delete_many([_version_key(table) for table in _get_model_tables(model)])
+
+
+def _invalidate_instance(sender, **kwargs):
+    invalidate(sender)
+
+
+def _invalidate_m2m(sender, action, **kwargs):
+    if action.startswith('post_'):
+        invalidate(sender)
+
+
+# Tables the signals of the models writing to are connected.
+_connected_tables = set()
+
+
+def connect_signals(tables):
+    """
+    Invalidate cached choices when instances of the models writing to
+    tables, many to many through ones included, are altered.
+    """
+    tables = set(tables) - _connected_tables
+    if not tables:
+        return
+    for model in get_models(include_auto_created=True):
+        if _get_model_tables(model) & tables:
+            post_save.connect(_invalidate_instance, sender=model, dispatch_uid='dynamic_choices.cache')
+            post_delete.connect(_invalidate_instance, sender=model, dispatch_uid='dynamic_choices.cache')
+            m2m_changed.connect(_invalidate_m2m, sender=model, dispatch_uid='dynamic_choices.cache')
+    _connected_tables.update(tables)
@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+from django.db.models.constants import LOOKUP_SEP
+
+_graphs = {}
+
+
+class DependencyGraph(object):
+
+    """
+    Dependencies between the fields of a model and its dynamic choices
+    fields built from their choices callback relationships.
+    """
+
+    def __init__(self, parents=()):
+        self.parents = tuple(parents)
+        self._fields = {}
+        self._cache = {}
+
+    @property
+    def fields(self):
+        """Descriptors of each dynamic field, inherited ones included."""
+        def build():
+            fields = {}
+            for parent in self.parents:
+                fields.update(parent.fields)
+            fields.update(self._fields)
+            return fields
+        return self._memoize('fields', build)
+
+    def add(self, name, descriptors):
+        self._fields[name] = tuple(descriptors)
+        # Graphs of subclasses are built from this one
+        for graph in _graphs.values():
+            graph._cache.clear()
+
+    def _memoize(self, key, func):
+        try:
+            return self._cache[key]
+        except KeyError:
+            result = self._cache[key] = func()
+            return result
+
+    @property
+    def relationships(self):
+        """Names of the dynamic fields depending on each descriptor."""
+        def build():
+            relationships = {}
+            for name, descriptors in self.fields.items():
+                for descriptor in descriptors:
+                    relationships.setdefault(descriptor, set()).add(name)
+            return dict((descriptor, frozenset(names)) for descriptor, names in relationships.items())
+        return self._memoize('relationships', build)
+
+    @property
+    def requirements(self):
+        """Names of the fields each dynamic field depends on."""
+        def build():
+            return dict((name, frozenset(
+                descriptor.split(LOOKUP_SEP)[0] for descriptor in descriptors
+            ) - set([name])) for name, descriptors in self.fields.items())
+        return self._memoize('requirements', build)
+
+    @property
+    def dependents(self):
+        """Names of the dynamic fields directly depending on each field."""
+        def build():
+            dependents = {}
+            for name, requirements in self.requirements.items():
+                for requirement in requirements:
+                    dependents.setdefault(requirement, set()).add(name)
+            return dict((name, frozenset(names)) for name, names in dependents.items())
+        return self._memoize('dependents', build)
+
+    @property
+    def closure(self):
+        """Names of the dynamic fields transitively depending on each field."""
+        def build():
+            dependents = self.dependents
+            closure = {}
+            for name in dependents:
+                names = set()
+                pending = [name]
+                while pending:
+                    for dependent in dependents.get(pending.pop(), ()):
+                        if dependent not in names:
+                            names.add(dependent)
+                            pending.append(dependent)
+                closure[name] = frozenset(names)
+            return closure
+        return self._memoize('closure', build)
+
+    def get_related_dependents(self, name):
+        """
+        Return the names of the dynamic fields directly depending on each
+        field of the model the foreign key with the specified name points to.
+        """
+        def build():
+            dependents = {}
+            for descriptor, names in self.relationships.items():
+                lookups = descriptor.split(LOOKUP_SEP)
+                if len(lookups) > 1 and lookups[0] == name:
+                    dependents.setdefault(lookups[1], set()).update(names)
+            return dict((field, frozenset(names)) for field, names in dependents.items())
+        return self._memoize(('related', name), build)
+
+
+def get_dependency_graph(model):
+    """Return the dependency graph of the dynamic fields of model."""
+    model = model._meta.concrete_model
+    try:
+        return _graphs[model]
+    except KeyError:
+        # Multi-table inheritance children inherit their parents' fields
+        parents = [get_dependency_graph(parent) for parent in model._meta.get_parent_list()]
+        return _graphs.setdefault(model, DependencyGraph(parents))
@@ -11,18 +11,209 @@ from django.db.models.fields import Field, FieldDoesNotExist
 from django.db.models.fields.related import add_lazy_relation
 from django.db.models.query import QuerySet
 from django.db.models.signals import class_prepared
-from django.forms.models import model_to_dict
 from django.utils import six
+from django.utils.encoding import force_text
 
 from ..forms.fields import (
     DynamicModelChoiceField, DynamicModelMultipleChoiceField,
 )
-from .query import CompositeQuerySet, dynamic_queryset_factory
+from .cache import cached, make_key
+from .dependencies import get_dependency_graph
+from .query import (
+    CompositeQuerySet, dynamic_queryset_factory, get_identity_map,
+)
+
+
+MISSING = object()
+
+
+class ChoicesRelationshipResolver(object):
+
+    """
+    Resolution plan of a choices callback relationship descriptor
+    compiled once the model is prepared.
+    """
+
+    __slots__ = ('descriptor', 'fields', 'field', 'lookups', 'paths', 'related')
+
+    def __init__(self, descriptor, fields):
+        self.descriptor = descriptor
+        self.fields = tuple(fields)
+        self.field = self.fields[-1]
+        names = [field.name for field in self.fields]
+        last = len(names) - 1
+        # Keys to attempt in data along with the index of the field they
+        # match, the full descriptor is always attempted first.
+        self.lookups = ((descriptor, last),) + tuple(
+            (LOOKUP_SEP.join(names[:index + 1]), index) for index in range(last)
+        )
+        # Paths to select from the model the foreign key at a given index
+        # points to in order to resolve the remaining of the descriptor in a
+        # single query. Remaining intermediary foreign keys are selected in
+        # order to detect null ones.
+        self.paths = tuple(
+            tuple(LOOKUP_SEP.join(names[index + 1:end + 1]) for end in range(index + 1, len(names)))
+            for index in range(last)
+        )
+        # Remaining intermediary foreign keys to select along the instance
+        # the foreign key at a given index points to when an identity map
+        # is active.
+        self.related = tuple(
+            (LOOKUP_SEP.join(names[index + 1:last]),) if index + 1 < last else ()
+            for index in range(last)
+        )
+
+    def resolve(self, data):
+        """
+        Return the python value of the descriptor from data or MISSING
+        if it cannot be resolved.
+        """
+        for key, index in self.lookups:
+            if key in data:
+                value = data[key]
+                break
+        else:
+            return MISSING
+
+        field = self.field
+        if index != len(self.fields) - 1:
+            # Intermediary fields are ensured to be foreign keys
+            # by DynamicChoicesField definition validation.
+            if isinstance(value, list):
+                value = value[0] if value else None  # Make sure we've got a scalar
+            if value is None:
+                return MISSING
+            try:
+                value = self.resolve_related(index, value)
+            except Exception:
+                return MISSING
+            if value is MISSING:
+                return value
+        elif isinstance(value, list) and not isinstance(field, ManyToManyField):
+            value = value[0]  # Make sure we've got a scalar if its not a m2m
+
+        # Make sure foreign keys resolve to the same value whether or not
+        # the related instance is loaded.
+        if isinstance(value, Model) and isinstance(field, ForeignKey):
+            value = getattr(value, field.rel.field_name)
+
+        # Attempt to cast value, if failed it's invalid
+        try:
+            return field.to_python(value)
+        except Exception:
+            return MISSING
+
+    def resolve_related(self, index, value):
+        """
+        Resolve the remaining of the descriptor from the value of the foreign
+        key at the specified index.
+
+        Already loaded instances are walked through without hitting the
+        database. When an identity map is active the remaining instances
+        are loaded through it, otherwise a single query is issued for the
+        remaining hops.
+        """
+        fields = self.fields
+        last = len(fields) - 1
+        identity_map = get_identity_map()
+        while True:
+            while isinstance(value, Model):
+                index += 1
+                field = fields[index]
+                if index == last:
+                    if isinstance(field, ManyToManyField):
+                        if value.pk is None:
+                            return []
+                        return list(getattr(value, field.name).values_list('pk', flat=True))
+                    return getattr(value, field.attname)
+                try:
+                    value = getattr(value, field.get_cache_name())
+                except AttributeError:
+                    value = getattr(value, field.attname)
+                if value is None:
+                    return MISSING
+            rel = fields[index].rel
+            if identity_map is None or rel.field_name != rel.to._meta.pk.name:
+                break
+            value = identity_map.get(rel.to, value, self.related[index])
+            if value is None:
+                return MISSING
+
+        queryset = rel.to._default_manager.filter(**{rel.field_name: value})
+        rows = list(queryset.values_list(*self.paths[index]))
+        if not rows or None in rows[0][:-1]:
+            return MISSING
+        if isinstance(self.field, ManyToManyField):
+            return [row[-1] for row in rows if row[-1] is not None]
+        return rows[0][-1]
+
+
+class LazyInstanceData(object):
+
+    """
+    Mapping of a model instance field values materialized only once
+    they are accessed.
+    """
+
+    __slots__ = ('instance', 'cache')
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.cache = {}
+
+    def _get_field(self, name):
+        try:
+            field = self.instance._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise KeyError(name)
+        # Exclude reverse relationships
+        if not isinstance(field, Field):
+            raise KeyError(name)
+        return field
+
+    def __contains__(self, name):
+        try:
+            self._get_field(name)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, name):
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        field = self._get_field(name)
+        instance = self.instance
+        if isinstance(field, ManyToManyField):
+            value = getattr(instance, field.attname).all() if instance.pk else []
+        elif field.rel is None:
+            value = getattr(instance, field.attname)
+        else:
+            # Related instances are only provided when already loaded,
+            # resolvers take care of fetching them otherwise.
+            value = getattr(instance, field.get_cache_name(), getattr(instance, field.attname))
+        self.cache[name] = value
+        return value
 
 
 class DynamicChoicesField(object):
 
     def __init__(self, *args, **kwargs):
+        # Number of seconds choices are cached for, None disables caching
+        self.cache_choices = kwargs.pop('cache_choices', None)
+        # Fields of the related model searched by the autocomplete mode, only
+        # the selected choices are rendered when provided.
+        self.search_fields = kwargs.pop('search_fields', None)
+        # Number of choices returned per search page
+        self.search_page_size = kwargs.pop('search_page_size', 20)
+        # Field names, or an expression on Django 1.8+, of the related model
+        # choices labels are built from instead of instances.
+        self.choices_label = kwargs.pop('choices_label', None)
+        # Whether or not a choices callback defined as a method reads the
+        # instance beyond its relationships, computations of callbacks that
+        # don't are shared among instances.
+        self.choices_use_instance = kwargs.pop('choices_use_instance', True)
         super(DynamicChoicesField, self).__init__(*args, **kwargs)
         # Hack to bypass non iterable choices validation
         if isinstance(self._choices, six.string_types) or callable(self._choices):
@@ -70,7 +261,7 @@ class DynamicChoicesField(object):
         if len(spec.args) != args_length:
             error('Specified choices callback must accept only a single arg')
 
-        self._choices_callback_field_descriptors = {}
+        resolvers = []
 
         # We make sure field descriptors are valid
         for descriptor in self._choices_relationships:
@@ -112,7 +303,10 @@ class DynamicChoicesField(object):
                     error('Invalid descriptor "%s", choices are %s' % (
                           LOOKUP_SEP.join(descriptor), ', '.join(choice_descriptors)))
 
-            self._choices_callback_field_descriptors[descriptor] = fields
+            resolvers.append(ChoicesRelationshipResolver(descriptor, fields))
+
+        self._choices_relationship_resolvers = tuple(resolvers)
+        get_dependency_graph(self.model).add(self.name, self._choices_relationships)
 
     @property
     def has_choices_callback(self):
@@ -122,67 +316,76 @@ class DynamicChoicesField(object):
     def choices_relationships(self):
         return self._choices_relationships
 
-    def _invoke_choices_callback(self, model_instance, qs, data):
+    def _resolve_choices_relationships(self, data):
+        values = {}
+        for resolver in self._choices_relationship_resolvers:
+            value = resolver.resolve(data)
+            if value is not MISSING:
+                values[resolver.descriptor] = value
+        return values
+
+    def _call_choices_callback(self, model_instance, qs, values):
         args = [qs]
         # Make sure we pass the instance if the callback is a class method
         if self._choices_callback_requires_instance:
             args.insert(0, model_instance)
+        return self._choices_callback(*args, **values)
 
-        values = {}
-        for descriptor, fields in self._choices_callback_field_descriptors.items():
-            depth = len(fields)
-            step = 1
-            lookup_data = data
-            value = None
-
-            # Direct lookup
-            # foo__bar in data
-            if descriptor in data:
-                value = data[descriptor]
-                step = depth
-                field = fields[-1]
-            else:
-                # We're going to try to lookup every step of the descriptor.
-                # We first try field1, then field1__field2, etc..
-                # When there's a match we start over with fieldmatch and set the lookup data
-                # to the matched value.
-                field_name = "%s"
-                for field in fields:
-                    field_name = field_name % field.name
-                    if field_name in lookup_data:
-                        value = lookup_data[field_name]
-                        if step != depth:
-                            if isinstance(field, ManyToManyField):
-                                # We cannot lookup in m2m, it must be the final step
-                                break
-                            elif isinstance(value, list):
-                                value = value[0]  # Make sure we've got a scalar
-                            if isinstance(field, ForeignKey):
-                                if value is None:
-                                    break
-                                elif not isinstance(value, Model):
-                                    try:
-                                        value = field.rel.to.objects.get(pk=value)
-                                    except Exception:
-                                        break
-                                lookup_data = model_to_dict(value)
-                                field_name = "%s"
-                            step += 1
-                    elif step != depth:
-                        field_name = "%s%s%s" % (field_name, LOOKUP_SEP, '%s')
-
-            # We reached descriptors depth
-            if step == depth:
-                if isinstance(value, list) and \
-                        not isinstance(field, ManyToManyField):
-                    value = value[0]  # Make sure we've got a scalar if its not a m2m
-                # Attempt to cast value, if failed we don't assign since it's invalid
-                try:
-                    values[descriptor] = field.to_python(value)
-                except Exception:
-                    pass
+    def _choices_memo_key(self, model_instance, qs, values):
+        """
+        Return the key identifying the invocation of the choices callback
+        for model_instance, qs and the resolved relationships values or None
+        if it cannot be memoized.
+
+        Since callbacks defined as methods have access to the instance its
+        primary key is part of the key unless choices_use_instance is false.
+        Unsaved instances cannot be told apart and are never memoized.
+        """
+        pk = None
+        if self._choices_callback_requires_instance and self.choices_use_instance:
+            pk = model_instance.pk
+            if pk is None:
+                return None
+        try:
+            key = (
+                self, pk,
+                qs.db, force_text(qs.query), frozenset(
+                    (name, tuple(value) if isinstance(value, list) else value)
+                    for name, value in values.items()
+                )
+            )
+            hash(key)
+        except Exception:
+            return None
+        return key
+
+    def _memoized_choices_callback(self, model_instance, qs, data, memo):
+        values = self._resolve_choices_relationships(data)
+        key = self._choices_memo_key(model_instance, qs, values)
+        if key is None or memo is None:
+            return self._call_choices_callback(model_instance, qs, values), key
+
+        def invoke():
+            choices = self._call_choices_callback(model_instance, qs, values)
+            # Make sure grouped choices can be iterated over more than once
+            if not isinstance(choices, QuerySet):
+                choices = tuple(choices)
+            return choices
+        return memo.memoize(key, invoke), key
 
-        return self._choices_callback(*args, **values)
+    def _invoke_choices_callback(self, model_instance, qs, data):
+        memo = get_identity_map()
+        if memo is not None:
+            return self._memoized_choices_callback(model_instance, qs, data, memo)[0]
+        values = self._resolve_choices_relationships(data)
+        return self._call_choices_callback(model_instance, qs, values)
+
+    def _cached_choices(self, kind, key, queryset, func):
+        """
+        Return the choices materialized by func from queryset cached under
+        the memo key of their computation for cache_choices seconds.
+        """
+        return cached(make_key(kind, key), queryset, func, self.cache_choices)
 
     def __super(self):
         # Dirty hack to allow both DynamicChoicesForeignKey and DynamicChoicesManyToManyField
@@ -211,41 +414,124 @@ class DynamicChoicesField(object):
 
 class DynamicChoicesForeignKeyMixin(DynamicChoicesField):
 
+    def _invalid_choice_error(self, value):
+        return exceptions.ValidationError(self.error_messages['invalid'], code='invalid', params={
+            'model': self.rel.to._meta.verbose_name,
+            'field': self.rel.field_name,
+            'value': value,
+            'pk': value,  # included for backwards compatibility
+        })
+
+    def _choices_queryset(self, model_instance, relationships, **lookups):
+        queryset = self.rel.to._default_manager.filter(**lookups)
+        queryset = queryset.complex_filter(self.rel.limit_choices_to)
+
+        queryset = self._call_choices_callback(model_instance, queryset, relationships)
+
+        # If the choices are not a queryset we assume it's an iterable of couple
+        # of label and querysets.
+        if not isinstance(queryset, QuerySet):
+            queryset = CompositeQuerySet(qs[1] for qs in queryset)
+        return queryset
+
+    def _cached_valid_values(self, model_instance, relationships):
+        """
+        Return the cached values of every valid choice or None if they
+        cannot be cached.
+        """
+        if self.cache_choices is None:
+            return None
+        queryset = self.rel.to._default_manager.complex_filter(self.rel.limit_choices_to)
+        key = self._choices_memo_key(model_instance, queryset, relationships)
+        if key is None:
+            return None
+        queryset = self._choices_queryset(model_instance, relationships)
+        return self._cached_choices('values', key, queryset, lambda: frozenset(
+            queryset.values_list(self.rel.field_name, flat=True).iterator()
+        ))
+
     def validate(self, value, model_instance):
         if self.has_choices_callback:
             if value is None:
                 return
 
-            data = model_to_dict(model_instance)
-            for field in model_instance._meta.fields:
-                try:
-                    data[field.name] = getattr(model_instance, field.name)
-                except field.rel.to.DoesNotExist:
-                    pass
-            if model_instance.pk:
-                for m2m in model_instance._meta.many_to_many:
-                    data[m2m.name] = getattr(model_instance, m2m.name).all()
-
-            queryset = self.rel.to._default_manager.filter(**{self.rel.field_name: value})
-            queryset = queryset.complex_filter(self.rel.limit_choices_to)
-
-            queryset = self._invoke_choices_callback(model_instance, queryset, data)
-
-            # If the choices are not a queryset we assume it's an iterable of couple
-            # of label and querysets.
-            if not isinstance(queryset, QuerySet):
-                queryset = CompositeQuerySet(qs[1] for qs in queryset)
-
-            if not queryset.exists():
-                raise exceptions.ValidationError(self.error_messages['invalid'], code='invalid', params={
-                    'model': self.rel.to._meta.verbose_name,
-                    'field': self.rel.field_name,
-                    'value': value,
-                    'pk': value,  # included for backwards compatibility
-                })
+            data = LazyInstanceData(model_instance)
+            relationships = self._resolve_choices_relationships(data)
+            valid = self._cached_valid_values(model_instance, relationships)
+            if valid is None:
+                queryset = self._choices_queryset(model_instance, relationships, **{self.rel.field_name: value})
+                if not queryset.exists():
+                    raise self._invalid_choice_error(value)
+            elif value not in valid:
+                raise self._invalid_choice_error(value)
         else:
             super(DynamicChoicesForeignKeyMixin, self).validate(value, model_instance)
 
+    def validate_many(self, instances, batch_size=None):
+        """
+        Validate the value of this field on many instances at once and
+        return a list of ValidationError, or None when valid, aligned
+        with instances.
+
+        Instances are grouped by the resolved values of their choices
+        relationships, and by instance when the callback is a method unless
+        choices_use_instance is false. The choices callback is invoked once
+        per group, with the first instance of the group, and the values of
+        the whole group are validated in a single query per batch_size values.
+        """
+        instances = list(instances)
+        errors = [None] * len(instances)
+
+        if not self.has_choices_callback:
+            for index, instance in enumerate(instances):
+                try:
+                    self.validate(getattr(instance, self.attname), instance)
+                except exceptions.ValidationError as e:
+                    errors[index] = e
+            return errors
+
+        to_python = self.rel.get_related_field().to_python
+        use_instance = self._choices_callback_requires_instance and self.choices_use_instance
+        groups = {}
+        for index, instance in enumerate(instances):
+            value = getattr(instance, self.attname)
+            if value is None:
+                continue
+            try:
+                value = to_python(value)
+            except exceptions.ValidationError:
+                errors[index] = self._invalid_choice_error(value)
+                continue
+            relationships = self._resolve_choices_relationships(LazyInstanceData(instance))
+            key = frozenset(relationships.items())
+            if use_instance:
+                key = (key, index if instance.pk is None else instance.pk)
+            try:
+                hash(key)
+            except TypeError:
+                # Unhashable relationships values such as many to many
+                # querysets cannot be grouped.
+                key = index
+            if key not in groups:
+                groups[key] = (instance, relationships, [])
+            groups[key][2].append((index, value))
+
+        lookup = "%s__in" % self.rel.field_name
+        for instance, relationships, members in groups.values():
+            valid = self._cached_valid_values(instance, relationships)
+            if valid is None:
+                values = list(set(value for _index, value in members))
+                step = batch_size or len(values)
+                valid = set()
+                for start in range(0, len(values), step):
+                    queryset = self._choices_queryset(instance, relationships, **{lookup: values[start:start + step]})
+                    valid.update(queryset.values_list(self.rel.field_name, flat=True).iterator())
+            for index, value in members:
+                if value not in valid:
+                    errors[index] = self._invalid_choice_error(value)
+
+        return errors
+
 
 class DynamicChoicesForeignKey(DynamicChoicesForeignKeyMixin, ForeignKey):
 
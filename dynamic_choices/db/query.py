@@ -1,15 +1,138 @@
 from __future__ import unicode_literals
 
+import operator
+import threading
+from contextlib import contextmanager
+from functools import reduce
 from itertools import chain
 
 import django
-from django.db.models.query import EmptyQuerySet, QuerySet
+from django.db import connections
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.query import EmptyQuerySet, QuerySet, RawQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils import six
+
+# Name of the column discriminating the queryset rows originate from
+# when CompositeQuerySet are compiled into a single UNION ALL query.
+GROUP_COLUMN = 'dynamic_choices_group'
+
+_local = threading.local()
+
+
+class IdentityMap(object):
+
+    """
+    A map of model instances ensuring a given (model, pk) is loaded
+    at most once while it's active. It's also used to memoize identical
+    choices computations for the same duration.
+    """
+
+    def __init__(self):
+        self._instances = {}
+        self._memo = {}
+
+    def memoize(self, key, func):
+        """Return the result of func memoized under key."""
+        try:
+            return self._memo[key]
+        except KeyError:
+            result = self._memo[key] = func()
+            return result
+
+    @staticmethod
+    def _key(model, pk):
+        model = model._meta.concrete_model
+        return model, model._meta.pk.to_python(pk)
+
+    def add(self, instance):
+        self._instances[self._key(instance.__class__, instance.pk)] = instance
+
+    def get(self, model, pk, select_related=()):
+        """
+        Return the instance of model with the specified pk or None if it
+        doesn't exist. Instances reachable through select_related paths
+        are added to the map when the instance is loaded.
+        """
+        key = self._key(model, pk)
+        try:
+            return self._instances[key]
+        except KeyError:
+            pass
+        queryset = key[0]._default_manager.all()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        try:
+            instance = queryset.get(pk=key[1])
+        except key[0].DoesNotExist:
+            instance = None
+        else:
+            for path in select_related:
+                related = instance
+                for name in path.split(LOOKUP_SEP):
+                    related = getattr(related, related._meta.get_field(name).get_cache_name(), None)
+                    if related is None:
+                        break
+                    self.add(related)
+        self._instances[key] = instance
+        return instance
+
+
+def get_identity_map():
+    """Return the active identity map if any."""
+    return getattr(_local, 'identity_map', None)
+
+
+@contextmanager
+def identity_map(active=None):
+    """
+    Activate an identity map for the duration of the block. The specified
+    one, or the already active one, is used or a new one is created.
+    """
+    previous = get_identity_map()
+    if active is None:
+        if previous is not None:
+            yield previous
+            return
+        active = IdentityMap()
+    _local.identity_map = active
+    try:
+        yield active
+    finally:
+        if previous is None:
+            del _local.identity_map
+        else:
+            _local.identity_map = previous
+
+
+def _enumerate_querysets(querysets):
+    for index, qs in enumerate(querysets):
+        for result in qs.iterator():
+            yield index, result
+
+
+def _pop_union_columns(obj, offset):
+    """
+    Remove the GROUP_COLUMN and ordering columns a union sets on obj and
+    return the index of the queryset it originates from along with it.
+    """
+    for index in range(offset - 1):
+        delattr(obj, "%s_order_%d" % (GROUP_COLUMN, index))
+    group = getattr(obj, GROUP_COLUMN)
+    delattr(obj, GROUP_COLUMN)
+    return group, obj
 
 
 class CompositeQuerySet(object):
 
     """
-    A queryset like object composed of multiple querysets
+    A queryset like object composed of multiple querysets.
+
+    When the querysets can be combined exists() and get() are performed
+    using a single query on the union of their filters while iteration,
+    slicing and count() use a single UNION ALL query. Otherwise every
+    queryset is queried one after the other.
     """
 
     def __init__(self, querysets):
@@ -17,16 +140,260 @@ class CompositeQuerySet(object):
         self.model = self.querysets[0].model
         assert all(qs.model == self.model for qs in self.querysets[1:]), \
             'All querysets must be of the same model'
+        self._fields = None
+        self._flat = False
 
     @property
     def querysets(self):
         return self._querysets
 
+    @property
+    def db(self):
+        return self.querysets[0].db
+
+    def _clone(self, querysets):
+        clone = self.__class__(querysets)
+        clone._fields = self._fields
+        clone._flat = self._flat
+        return clone
+
+    def _component_querysets(self):
+        if self._fields is None:
+            return self.querysets
+        return tuple(qs.values_list(*self._fields, flat=self._flat) for qs in self.querysets)
+
+    def _combine(self):
+        """
+        Return a queryset matching the rows of any of the querysets
+        or None if they cannot be combined.
+        """
+        db = self.db
+        if any(qs.db != db for qs in self.querysets[1:]):
+            return None
+        try:
+            return reduce(operator.or_, self._component_querysets())
+        except (AssertionError, TypeError):
+            return None
+
+    def _union_ordering(self):
+        """
+        Return the (field, descending) couples of the querysets shared
+        ordering or None if it cannot be expressed on a UNION ALL query.
+        """
+        opts = self.model._meta
+        orderings = set()
+        for qs in self.querysets:
+            query = qs.query
+            if query.is_empty():
+                continue
+            if query.extra_order_by:
+                return None
+            if query.order_by:
+                ordering = query.order_by
+            elif query.default_ordering:
+                ordering = opts.ordering
+            else:
+                ordering = ()
+            orderings.add(tuple(ordering))
+        if len(orderings) > 1:
+            return None
+
+        fields = []
+        for ordering in (orderings.pop() if orderings else ()):
+            if not isinstance(ordering, six.string_types):
+                return None
+            descending = ordering.startswith('-')
+            name = ordering[1:] if descending else ordering
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+            # Ordering by a relationship uses the related model ordering and
+            # inherited fields' tables are not joined by values_list queries.
+            if (field.rel is not None or field not in opts.concrete_fields or
+                    field.model._meta.concrete_model is not opts.concrete_model):
+                return None
+            fields.append((field, descending))
+        return fields
+
+    def _compile_union(self, ordered=True, limits=None):
+        """
+        Return a compiler of the first non-empty queryset, the SQL and
+        params of a UNION ALL query selecting the rows of every queryset
+        along with a GROUP_COLUMN containing the index of the queryset they
+        originate from, the position of the GROUP_COLUMN and the number of
+        columns selected before the rows ones. None is returned if the
+        querysets cannot be combined.
+        """
+        if ordered:
+            ordering = self._union_ordering()
+            if ordering is None:
+                return None
+        else:
+            ordering = ()
+
+        db = self.db
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        deferred_loading = self.querysets[0].query.deferred_loading
+
+        order_by = [qn(GROUP_COLUMN)]
+        select = {}
+        for index, (field, descending) in enumerate(ordering):
+            alias = "%s_order_%d" % (GROUP_COLUMN, index)
+            select[alias] = "%s.%s" % (qn(field.model._meta.db_table), qn(field.column))
+            order_by.append("%s DESC" % qn(alias) if descending else qn(alias))
+
+        compiler = None
+        group = 0
+        parts, params = [], []
+        for index, qs in enumerate(self.querysets):
+            query = qs.query
+            if (qs.db != db or not query.can_filter() or query.select_related or query.extra_select or
+                    getattr(query, 'annotations', getattr(query, 'aggregates', None)) or
+                    query.deferred_loading != deferred_loading or query.distinct_fields or
+                    getattr(qs, '_fields', None) is not None or qs._prefetch_related_lookups):
+                return None
+            extra = dict(select, **{GROUP_COLUMN: str(index)})
+            qs = qs.extra(select=extra)
+            if self._fields is not None:
+                qs = qs.values_list(*(tuple(extra) + tuple(self._fields)))
+            query = qs.query
+            # Extra columns are selected in the order of the extra_select
+            # mapping which isn't necessarily the insertion one.
+            group = list(query.extra_select).index(GROUP_COLUMN)
+            query.clear_ordering(True)
+            query_compiler = query.get_compiler(db)
+            try:
+                sql, sql_params = query_compiler.as_sql()
+            except EmptyResultSet:
+                continue
+            if compiler is None:
+                compiler = query_compiler
+            parts.append(sql)
+            params.extend(sql_params)
+
+        sql = ' UNION ALL '.join(parts)
+        if sql and ordered:
+            sql = "%s ORDER BY %s" % (sql, ', '.join(order_by))
+        if sql and limits:
+            low, high = limits
+            if high is not None:
+                sql = "%s LIMIT %d" % (sql, high - low)
+            if low:
+                if high is None:
+                    no_limit = connection.ops.no_limit_value()
+                    if no_limit:
+                        sql = "%s LIMIT %d" % (sql, no_limit)
+                sql = "%s OFFSET %d" % (sql, low)
+        return compiler, sql, params, group, len(select) + 1
+
+    def _iter_union(self, limits=None):
+        """
+        Return an iterator of (group, result) couples using a single UNION
+        ALL query or None if the querysets cannot be combined.
+        """
+        if limits is not None and connections[self.db].vendor == 'oracle':
+            # Oracle doesn't support LIMIT/OFFSET
+            return None
+        union = self._compile_union(limits=limits)
+        if union is None:
+            return None
+        compiler, sql, params, group, offset = union
+        if not sql:
+            return iter(())
+        if self._fields is None:
+            return (
+                _pop_union_columns(obj, offset)
+                for obj in RawQuerySet(sql, model=self.model, params=params, using=self.db)
+            )
+        # Execute the query through the compiler of one of the querysets
+        # in order to have their values converted by the backend.
+        compiler.as_sql = lambda *args, **kwargs: (sql, params)
+        if self._flat:
+            return ((row[group], row[offset]) for row in compiler.results_iter())
+        return ((row[group], tuple(row[offset:])) for row in compiler.results_iter())
+
+    def group_iterator(self):
+        """
+        Return an iterator of (index of the originating queryset, result)
+        couples.
+        """
+        union = self._iter_union()
+        if union is None:
+            return _enumerate_querysets(self._component_querysets())
+        return union
+
+    def iterator(self):
+        union = self._iter_union()
+        if union is None:
+            return chain(*(qs.iterator() for qs in self._component_querysets()))
+        return (result for _group, result in union)
+
     def __iter__(self):
-        return chain(*self.querysets)
+        union = self._iter_union()
+        if union is None:
+            return chain(*self._component_querysets())
+        return (result for _group, result in union)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, k):
+        if not isinstance(k, (slice,) + six.integer_types):
+            raise TypeError
+        assert ((not isinstance(k, slice) and (k >= 0)) or
+                (isinstance(k, slice) and (k.start is None or k.start >= 0) and
+                 (k.stop is None or k.stop >= 0))), \
+            "Negative indexing is not supported."
+
+        if isinstance(k, slice):
+            low, high = k.start or 0, k.stop
+            if high is not None and high <= low:
+                return []
+        else:
+            low, high = k, k + 1
+
+        union = self._iter_union(limits=(low, high))
+        if union is not None:
+            results = [result for _group, result in union]
+        else:
+            # Only query the querysets the slice spans over.
+            results = []
+            for qs in self._component_querysets():
+                count = qs.count()
+                if low >= count:
+                    low -= count
+                    if high is not None:
+                        high -= count
+                    continue
+                results.extend(qs[low:high])
+                if high is not None:
+                    high -= count
+                    if high <= 0:
+                        break
+                low = 0
+
+        if isinstance(k, slice):
+            return results[::k.step] if k.step else results
+        try:
+            return results[0]
+        except IndexError:
+            raise IndexError('list index out of range')
 
     def get(self, *args, **kwargs):
-        for qs in self.querysets:
+        combined = self._combine()
+        if combined is not None:
+            try:
+                return combined.get(*args, **kwargs)
+            except self.model.MultipleObjectsReturned:
+                # The object might be returned by many querysets or
+                # be shadowed by one returned by a preceding queryset.
+                pass
+        for qs in self._component_querysets():
             try:
                 obj = qs.get(*args, **kwargs)
             except self.model.DoesNotExist:
@@ -36,8 +403,8 @@ class CompositeQuerySet(object):
         raise self.model.DoesNotExist
 
     def _compose(self, method, *args, **kwargs):
-        return self.__class__(getattr(qs, method)(*args, **kwargs)
-                              for qs in self.querysets)
+        return self._clone(getattr(qs, method)(*args, **kwargs)
+                           for qs in self.querysets)
 
     def filter(self, *args, **kwargs):
         return self._compose('filter', *args, **kwargs)
@@ -45,9 +412,46 @@ class CompositeQuerySet(object):
     def distinct(self):
         return self._compose('distinct')
 
+    def annotate(self, *args, **kwargs):
+        return self._compose('annotate', *args, **kwargs)
+
+    def only(self, *fields):
+        return self._compose('only', *fields)
+
+    def defer(self, *fields):
+        return self._compose('defer', *fields)
+
+    def values_list(self, *fields, **kwargs):
+        flat = kwargs.pop('flat', False)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments to values_list: %s' % (list(kwargs),))
+        if flat and len(fields) > 1:
+            raise TypeError("'flat' is not valid when values_list is called with more than one field.")
+        clone = self._clone(self.querysets)
+        clone._fields = fields or tuple(field.attname for field in self.model._meta.concrete_fields)
+        clone._flat = flat
+        return clone
+
     def exists(self):
+        combined = self._combine()
+        if combined is not None:
+            return combined.exists()
         return any(qs.exists() for qs in self.querysets)
 
+    def count(self):
+        union = self._compile_union(ordered=False)
+        if union is None:
+            return sum(qs.count() for qs in self.querysets)
+        _compiler, sql, params, _group, _offset = union
+        if not sql:
+            return 0
+        cursor = connections[self.db].cursor()
+        try:
+            cursor.execute("SELECT COUNT(*) FROM (%s) dynamic_choices_union" % sql, params)
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
 
 class EmptyDynamicChoicesQuerySet(EmptyQuerySet):
 
@@ -67,10 +471,26 @@ class DynamicChoicesQuerySet(QuerySet):
             if self.query.is_empty():
                 return self
             return self._field._invoke_choices_callback(instance, self, data)
+
+        def memoized_filter_for_instance(self, instance, data, memo):
+            """
+            Return the choices for instance memoized in memo along
+            with the key they are memoized under, if any.
+            """
+            if self.query.is_empty():
+                return self, None
+            return self._field._memoized_choices_callback(instance, self, data, memo)
     else:
         def filter_for_instance(self, instance, data):
             return self._field._invoke_choices_callback(instance, self, data)
 
+        def memoized_filter_for_instance(self, instance, data, memo):
+            """
+            Return the choices for instance memoized in memo along
+            with the key they are memoized under, if any.
+            """
+            return self._field._memoized_choices_callback(instance, self, data, memo)
+
         def none(self):
             return self._clone(klass=EmptyDynamicChoicesQuerySet)
 
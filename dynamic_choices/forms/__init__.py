@@ -1,7 +1,9 @@
 from __future__ import unicode_literals
 
 from django.forms.models import ModelForm
+from django.utils.encoding import force_text
 
+from ..db.dependencies import get_dependency_graph
 from .fields import DynamicModelChoiceField, DynamicModelMultipleChoiceField  # NOQA
 
 
@@ -26,23 +28,90 @@ def original_dynamic_model_form_factory(model_form_cls):
                     elif field in data:
                         del data[field]
 
+            self._dynamic_choices_data = data
+
             # Bind instances to dynamic fields
             for field in self.fields.values():
                 if isinstance(field, DynamicModelChoiceField):
                     field.set_choice_data(self.instance, data)
 
+        def _get_dynamic_field_names(self):
+            return set(name for name, field in self.fields.items() if isinstance(field, DynamicModelChoiceField))
+
         def get_dynamic_relationships(self):
             rels = {}
-            opts = self.instance._meta
-            for name, field in self.fields.items():
-                # TODO: check for excludes?
-                if isinstance(field, DynamicModelChoiceField):
-                    for choice in opts.get_field(name).choices_relationships:
-                        if not (choice in rels):
-                            rels[choice] = set()
-                        rels[choice].add(name)
+            names = self._get_dynamic_field_names()
+            for rel, fields in get_dependency_graph(self._meta.model).relationships.items():
+                fields = fields & names
+                if fields:
+                    rels[rel] = set(fields)
             return rels
 
+        def get_cascaded_dynamic_choices(self, names, stream=False, checked=()):
+            """
+            Return the choices of the specified dynamic fields and of the ones
+            depending on them transitively, evaluated in dependency order, along
+            with the names of the fields whose value isn't a valid choice anymore.
+
+            Invalidated values are removed from the choice data of the fields
+            evaluated after them just like if they were submitted empty.
+
+            When stream is true the choices of the fields whose value needn't be
+            checked, the ones without value or dependents, are lazy iterators.
+            Fields named in checked, which others depend on, are always checked.
+            """
+            graph = get_dependency_graph(self._meta.model)
+            dynamic_names = self._get_dynamic_field_names()
+
+            cascaded = set(name for name in names if name in self.fields)
+            for name in list(cascaded):
+                cascaded.update(graph.closure.get(name, frozenset()) & dynamic_names)
+            requirements = dict((name, graph.requirements.get(name, frozenset())) for name in cascaded)
+            dependents = graph.dependents
+
+            data = self._dynamic_choices_data
+            choices = {}
+            invalidated = set()
+            remaining = set(cascaded)
+            while remaining:
+                # Fall back to evaluating the remaining fields at once on cycles
+                ready = [name for name in remaining if not requirements[name] & remaining] or remaining
+                for name in sorted(ready):
+                    remaining.discard(name)
+                    field = self.fields[name]
+                    if not isinstance(field, DynamicModelChoiceField):
+                        continue
+                    if stream and (name not in data or not (
+                            name in checked or dependents.get(name, frozenset()) & dynamic_names)):
+                        # Its value would invalidate no other field
+                        choices[name] = field.iter_choices()
+                        continue
+                    choices[name] = list(field.widget.choices)
+                    if name not in data:
+                        continue
+                    valid = set()
+                    for value, label in choices[name]:
+                        if isinstance(label, (list, tuple)):
+                            valid.update(force_text(choice) for choice, _label in label)
+                        else:
+                            valid.add(force_text(value))
+                    value = data[name]
+                    if isinstance(value, (list, tuple)):
+                        kept = [item for item in value if force_text(item) in valid]
+                    else:
+                        kept = value if force_text(value) in valid else None
+                    if kept != value:
+                        invalidated.add(name)
+                        if kept:
+                            data[name] = kept
+                        else:
+                            del data[name]
+                        for dependent in dependents.get(name, ()):
+                            field = self.fields.get(dependent)
+                            if isinstance(field, DynamicModelChoiceField):
+                                field.set_choice_data(self.instance, data)
+            return choices, invalidated
+
     cls.__name__ = str("Dynamic%s" % model_form_cls.__name__)
     return cls
 
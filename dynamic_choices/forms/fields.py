@@ -1,12 +1,25 @@
 from __future__ import unicode_literals
 
+import operator
+from functools import partial, reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.forms.fields import ChoiceField
 from django.forms.models import (
     ModelChoiceField, ModelChoiceIterator, ModelMultipleChoiceField,
 )
+from django.utils import six
+from django.utils.encoding import force_text
+from django.utils.translation import get_language
+
+from ..db.query import (
+    CompositeQuerySet, DynamicChoicesQuerySet, get_identity_map, identity_map,
+)
 
-from ..db.query import CompositeQuerySet, DynamicChoicesQuerySet
+# Alias of the annotation choices labels expressions are selected as.
+LABEL_ALIAS = 'dynamic_choices_label'
 
 
 class GroupedModelChoiceIterator(ModelChoiceIterator):
@@ -15,15 +28,123 @@ class GroupedModelChoiceIterator(ModelChoiceIterator):
         super(GroupedModelChoiceIterator, self).__init__(field)
         self.groups = field._groups
 
+    def _get_grouped_choices(self):
+        """
+        Fetch the choices of every group in a single query and cache
+        them on the field in order to share them among iterators.
+        """
+        cache = self.field._grouped_choices
+        if cache is None or cache[0] is not self.groups:
+            cache = self.field._grouped_choices = (self.groups, self.field._memoize_choices(
+                'grouped', self._fetch_grouped_choices
+            ))
+        return cache[1]
+
+    def _fetch_grouped_choices(self):
+        grouped_choices = [(label, []) for label, _queryset in self.groups]
+        queryset = CompositeQuerySet(queryset for _label, queryset in self.groups)
+        rows = self.field._get_label_rows(queryset)
+        if rows is not None:
+            for index, row in rows.group_iterator():
+                grouped_choices[index][1].append(self.field._label_choice(row))
+            return grouped_choices
+        for index, obj in queryset.group_iterator():
+            grouped_choices[index][1].append(self.choice(obj))
+        return grouped_choices
+
     def __iter__(self):
         if self.field.empty_label is not None:
             yield ("", self.field.empty_label)
 
-        for label, queryset in self.groups:
-            yield (label, [self.choice(obj) for obj in queryset])
+        for group in self._get_grouped_choices():
+            yield group
 
     def __len__(self):
-        return sum(len(group[1]) for group in self.groups)
+        return sum(len(group[1]) for group in self._get_grouped_choices())
+
+
+class MemoizedModelChoiceIterator(ModelChoiceIterator):
+
+    """
+    Choices iterator sharing its materialized choices with the ones of
+    identical choices computations.
+    """
+
+    def _get_choices(self):
+        return self.field._memoize_choices('choices', self._fetch_choices)
+
+    def _fetch_choices(self):
+        rows = self.field._get_label_rows(self.queryset)
+        if rows is not None:
+            return [self.field._label_choice(row) for row in rows.iterator()]
+        return [self.choice(obj) for obj in self.queryset.all()]
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+
+        for choice in self._get_choices():
+            yield choice
+
+    def __len__(self):
+        return len(self._get_choices()) + (1 if self.field.empty_label is not None else 0)
+
+
+class LabelModelChoiceIterator(ModelChoiceIterator):
+
+    """
+    Choices iterator building the choices of a field declaring its labels
+    source from the selected columns instead of model instances.
+    """
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+
+        for row in self.field._get_label_rows(self.queryset).iterator():
+            yield self.field._label_choice(row)
+
+    def __len__(self):
+        return self.queryset.count() + (1 if self.field.empty_label is not None else 0)
+
+
+class SelectedModelChoiceIterator(LabelModelChoiceIterator):
+
+    """
+    Choices iterator of a searchable field only yielding its selected
+    choices, the other ones are retrieved through searches.
+    """
+
+    def __init__(self, field):
+        super(SelectedModelChoiceIterator, self).__init__(field)
+        self.queryset = field._get_selected_queryset()
+
+    def __iter__(self):
+        if self.field._choices_label is not None:
+            return super(SelectedModelChoiceIterator, self).__iter__()
+        return ModelChoiceIterator.__iter__(self)
+
+
+class LazyChoiceIterator(object):
+
+    """
+    Defer the creation of a field's choices iterator, and thus the
+    evaluation of its choices callback, until they are actually needed.
+    """
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        return iter(self.field.choices)
+
+    def __len__(self):
+        return len(self.field.choices)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.field.choices, name)
 
 
 class DynamicModelChoiceField(ModelChoiceField):
@@ -31,34 +152,233 @@ class DynamicModelChoiceField(ModelChoiceField):
     def __init__(self, *args, **kwargs):
         self._instance = None
         self._data = {}
+        self._identity_map = None
+        self._memo_key = None
+        self._cache_key = None
+        self._filtered_queryset = None
         self._groups = None
+        self._grouped_choices = None
         super(DynamicModelChoiceField, self).__init__(*args, **kwargs)
 
-    def _get_queryset(self):
-        return self._queryset.distinct()
-
-    def _set_queryset(self, queryset):
-        self._original_queryset = queryset
+    def _filter_queryset(self):
+        queryset = self._queryset
         self._groups = None
+        self._grouped_choices = None
+        self._memo_key = None
+        self._cache_key = None
         if self._instance and isinstance(queryset, DynamicChoicesQuerySet):
-            queryset = queryset.filter_for_instance(self._instance, self._data)
+            cache_choices = queryset._field.cache_choices is not None
+            if self._identity_map is None:
+                if cache_choices:
+                    queryset, self._cache_key = queryset.memoized_filter_for_instance(
+                        self._instance, self._data, None
+                    )
+                else:
+                    queryset = queryset.filter_for_instance(self._instance, self._data)
+            else:
+                # Make sure related objects are resolved through the identity
+                # map that was active when the choice data was set and identical
+                # choices computations are shared.
+                with identity_map(self._identity_map) as memo:
+                    queryset, self._memo_key = queryset.memoized_filter_for_instance(
+                        self._instance, self._data, memo
+                    )
+                if cache_choices:
+                    self._cache_key = self._memo_key
             if not isinstance(queryset, QuerySet):
-                self._groups = queryset
+                self._groups = queryset = tuple(queryset)
                 queryset = CompositeQuerySet(q[1] for q in queryset)
+        self._filtered_queryset = queryset
+        return queryset
+
+    def _memoize_choices(self, kind, func):
+        """
+        Share the choices materialized by func among fields of the same
+        class with identical choices computations and cache them across
+        requests if the model field caches its choices. Labels are translated
+        so choices are cached per active language.
+        """
+        if self._cache_key is not None:
+            func = partial(
+                self._queryset._field._cached_choices, kind,
+                (self._cache_key, self.__class__, self.to_field_name, get_language()),
+                self._filtered_queryset, func
+            )
+        if self._memo_key is None:
+            return func()
+        key = (kind, self._memo_key, self.__class__, self.to_field_name)
+        return self._identity_map.memoize(key, func)
+
+    @property
+    def _choices_label(self):
+        """The labels source declared by the model field, if any."""
+        return getattr(getattr(self._queryset, '_field', None), 'choices_label', None)
+
+    def _get_label_rows(self, queryset, *columns):
+        """
+        Return the queryset of the specified columns followed by the value
+        and label ones of the choices of queryset or None if their labels
+        are built from instances.
+        """
+        label = self._choices_label
+        if label is None:
+            return None
+        columns += (self.to_field_name or 'pk',)
+        if isinstance(label, six.string_types):
+            label = (label,)
+        if isinstance(label, (list, tuple)):
+            return queryset.values_list(*(columns + tuple(label)))
+        return queryset.annotate(**{LABEL_ALIAS: label}).values_list(*(columns + (LABEL_ALIAS,)))
+
+    @staticmethod
+    def _label_choice(row):
+        return row[0], ' '.join(force_text(value) for value in row[1:] if value is not None)
+
+    @property
+    def searchable(self):
+        """Whether or not the choices of this field are searched."""
+        queryset = self._queryset
+        return isinstance(queryset, DynamicChoicesQuerySet) and bool(queryset._field.search_fields)
+
+    def _get_search_queryset(self):
+        """Return the filtered queryset with its groups flattened."""
+        queryset = self.queryset
+        if isinstance(queryset, CompositeQuerySet):
+            manager = self._queryset.model._default_manager
+            querysets = queryset.querysets
+            if not querysets:
+                return manager.none()
+            queryset = manager.filter(reduce(operator.or_, (
+                Q(pk__in=component.values('pk')) for component in querysets
+            ))).distinct()
+        return queryset
+
+    def _get_selected_queryset(self):
+        """Return the queryset of the selected choices."""
+        queryset = self._get_search_queryset()
+        values = self._data.get(self._queryset._field.name)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        values = [getattr(value, 'pk', value) for value in values if value not in self.empty_values]
+        if not values:
+            return queryset.none()
+        try:
+            return queryset.filter(**{"%s__in" % (self.to_field_name or 'pk'): values})
+        except (ValueError, TypeError, ValidationError):
+            return queryset.none()
+
+    def search_choices(self, term='', cursor=None):
+        """
+        Return a page of the choices matching every word of term following
+        the cursor, the primary key of the last choice of the previous page,
+        along with the cursor of the next page or None if it's the last one.
+        """
+        field = self._queryset._field
+        queryset = self._get_search_queryset()
+        for bit in term.split():
+            queryset = queryset.filter(reduce(operator.or_, (
+                Q(**{"%s__icontains" % name: bit}) for name in field.search_fields
+            )))
+        if cursor is not None:
+            queryset = queryset.filter(pk__gt=queryset.model._meta.pk.to_python(cursor))
+        page_size = field.search_page_size
+        queryset = queryset.order_by('pk')
+        # The primary key is selected since the choices value isn't when
+        # to_field_name is specified.
+        rows = self._get_label_rows(queryset, 'pk')
+        if rows is not None:
+            rows = list(rows[:page_size + 1])
+            choices = [self._label_choice(row[1:]) for row in rows[:page_size]]
+            return choices, rows[page_size - 1][0] if len(rows) > page_size else None
+        objs = list(queryset[:page_size + 1])
+        iterator = ModelChoiceIterator(self)
+        choices = [iterator.choice(obj) for obj in objs[:page_size]]
+        return choices, objs[page_size - 1].pk if len(objs) > page_size else None
+
+    def _iter_queryset_choices(self, queryset):
+        rows = self._get_label_rows(queryset)
+        if rows is not None:
+            return (self._label_choice(row) for row in rows.iterator())
+        # Prefetching requires the instances to be fetched all at once
+        if getattr(queryset, '_prefetch_related_lookups', None):
+            results = queryset.all()
+        else:
+            results = queryset.iterator()
+        choice = ModelChoiceIterator(self).choice
+        return (choice(obj) for obj in results)
+
+    def _iter_grouped_choices(self):
+        queryset = CompositeQuerySet(queryset for _label, queryset in self._groups)
+        rows = self._get_label_rows(queryset)
+        if rows is not None:
+            results, choice = rows.group_iterator(), self._label_choice
+        else:
+            results, choice = queryset.group_iterator(), ModelChoiceIterator(self).choice
+        # The rows of a group are consecutive, keep track of the pending
+        # one which belongs to a following group.
+        pending = [next(results, None)]
+
+        def group(index):
+            while pending[0] is not None and pending[0][0] <= index:
+                if pending[0][0] == index:
+                    yield choice(pending[0][1])
+                pending[0] = next(results, None)
+
+        for index, (label, _queryset) in enumerate(self._groups):
+            yield label, group(index)
+
+    def iter_choices(self):
+        """
+        Iterate over the choices of this field without materializing them,
+        rows are fetched by chunks as they're consumed. Groups are yielded
+        as couples of label and iterator which must be consumed in order.
+        """
+        if self._filtered_queryset is None:
+            self._filter_queryset()
+        if self.empty_label is not None:
+            yield ("", self.empty_label)
+        if self.searchable:
+            choices = self._iter_queryset_choices(self._get_selected_queryset())
+        elif self._groups is not None:
+            choices = self._iter_grouped_choices()
+        else:
+            choices = self._iter_queryset_choices(self.queryset)
+        for choice in choices:
+            yield choice
+
+    def _get_queryset(self):
+        queryset = self._filtered_queryset
+        if queryset is None:
+            queryset = self._filter_queryset()
+        return queryset.distinct()
+
+    def _set_queryset(self, queryset):
         self._queryset = queryset
-        self.widget.choices = self.choices
+        self._filtered_queryset = None
+        self.widget.choices = LazyChoiceIterator(self)
+        if self.searchable:
+            self.widget.attrs['data-dynamic-choices-search'] = 'true'
 
     queryset = property(_get_queryset, _set_queryset)
 
     def set_choice_data(self, instance, data):
         self._instance = instance
         self._data = data
-        self.queryset = self._original_queryset
+        self._identity_map = get_identity_map()
+        self.queryset = self._queryset
 
     def _get_choices(self):
-        if self._groups is None:
-            return super(DynamicModelChoiceField, self)._get_choices()
-        return GroupedModelChoiceIterator(self)
+        if self._filtered_queryset is None:
+            self._filter_queryset()
+        if self.searchable:
+            return SelectedModelChoiceIterator(self)
+        if self._groups is not None:
+            return GroupedModelChoiceIterator(self)
+        if self._memo_key is not None or self._cache_key is not None:
+            return MemoizedModelChoiceIterator(self)
+        if self._choices_label is not None:
+            return LabelModelChoiceIterator(self)
+        return super(DynamicModelChoiceField, self)._get_choices()
 
     choices = property(_get_choices, ChoiceField._set_choices)
 
@@ -1,56 +1,120 @@
 ($ || jQuery || django.jQuery)(function($) {
-    var assignOptions = $.fn.updateFields.widgetHandlers['default'];
+    var assignOptions = $.fn.updateFields.assignOptions,
+        selectWidgetHandler = $.fn.updateFields.widgetHandlers['default'];
 
     var filteredSelectMultiple = 'django.contrib.admin.widgets.FilteredSelectMultiple';
     $.fn.updateFields.widgetHandlers[filteredSelectMultiple] = function(field, values) {
-        var chosenField = $(field),
-            alreadyChosens = $(field.options).map(function(index, element) {
-                return element.value;
-            }),
-            availableField = $('#id_' + field.name + '_from'),
-            fromCache = [],
-            toCache = [],
-            availables = [],
-            chosens = [];
+        var availableField = $('#id_' + field.name + '_from');
 
         //The widget isn't initialized yet (it might a be an inline empty template)
         if (availableField.length == 0) {
-            return assignOptions(chosenField, values);
+            return selectWidgetHandler(field, values);
         }
 
-        SelectBox.cache['id_' + field.name + '_from'] = [];
-        SelectBox.cache['id_' + field.name + '_to'] = [];
-
-        availableField.empty();
-        chosenField.empty();
+        // Option values are strings while received ones might not be.
+        var alreadyChosens = {};
+        for (var i = 0; i < field.options.length; i++) {
+            alreadyChosens[field.options[i].value] = true;
+        }
 
-        $(values).each(function(index, value) {
-            //We cast the value to string since the "type" is lost when retreiving
-            //from option.value by SelectBox
-            var chosen = $.inArray(String(value[0]), alreadyChosens) != -1;
+        var fromCache = [],
+            toCache = [],
+            availables = [],
+            chosens = [];
+        for (var i = 0; i < values.length; i++) {
+            var value = values[i],
+                chosen = alreadyChosens.hasOwnProperty(String(value[0]));
             (chosen ? chosens : availables).push(value);
             (chosen ? toCache : fromCache).push({
                 value: value[0],
                 text: value[1],
                 displayed: 1
             });
-        });
+        }
 
         SelectBox.cache['id_' + field.name + '_from'] = fromCache;
         SelectBox.cache['id_' + field.name + '_to'] = toCache;
 
         assignOptions(availableField, availables);
-        assignOptions(chosenField, chosens);
+        assignOptions(field, chosens);
     };
 
-    django.dynamicAdmin = function(fields, inlines) {
+    django.dynamicAdmin = function(fields, inlines, inputs) {
         var url = document.location.pathname + 'choices/';
+        if (inputs) $.extend(true, $.fn.updateFields.inputs, inputs);
         for (f in fields) {
             $(f).bindFields(url, fields[f].join(', '));
         }
         for (f in inlines) {
             $('#' + f + '-group').bindFieldset(url, f, inlines[f]);
         }
+        django.dynamicAdmin.bindSearch(url);
+    };
+
+    var DATA_SEARCH = 'data-dynamic-choices-search',
+        SEARCH_CLASS = 'dynamic-choices-search',
+        MORE_CLASS = 'dynamic-choices-more';
+
+    function translate(text) {
+        return typeof gettext === 'function' ? gettext(text) : text;
+    }
+
+    // Options of a searchable select kept when its choices are searched, the
+    // empty and selected ones unless all of them are kept.
+    function keptOptions(select, all) {
+        return select.find('option').filter(function(index, option) {
+            return all || option.selected || option.value === '';
+        }).map(function(index, option) {
+            return [[option.value, option.text]];
+        }).toArray();
+    }
+
+    function searchChoices(url, input, more) {
+        var select = input.nextAll('select').first(),
+            cursor = more ? input.data('cursor') : null,
+            sequence = (input.data('sequence') || 0) + 1;
+        input.data('sequence', sequence);
+        select.addClass('loading');
+        select.searchChoices(url, input.val(), cursor).done(function(json) {
+            // Make sure the last search wins
+            if (input.data('sequence') !== sequence) return;
+            var options = keptOptions(select, more),
+                values = {};
+            for (var i = 0; i < options.length; i++) values[options[i][0]] = true;
+            for (var i = 0; i < json.choices.length; i++) {
+                if (!values.hasOwnProperty(String(json.choices[i][0]))) options.push(json.choices[i]);
+            }
+            $.fn.updateFields.widgetHandlers['default'](select[0], options);
+            input.data('cursor', json.cursor);
+            input.nextAll('.' + MORE_CLASS).first().toggle(json.cursor !== null);
+        }).always(function() {
+            if (input.data('sequence') === sequence) select.removeClass('loading');
+        });
+    }
+
+    // Add a search input to the selects of searchable fields, only their
+    // selected choices are rendered and the other ones are searched by page.
+    django.dynamicAdmin.bindSearch = function(url) {
+        $('select[' + DATA_SEARCH + ']').each(function(index, select) {
+            $(select).before(
+                $('<input type="text">').addClass(SEARCH_CLASS).attr('placeholder', translate('Search')),
+                $('<a href="#">').addClass(MORE_CLASS).text(translate('More')).hide()
+            );
+        });
+        var timeout = null;
+        // Delegate in order to handle inline rows added afterwards
+        $(document).delegate('input.' + SEARCH_CLASS, 'keyup', function() {
+            var input = $(this);
+            if (input.data('term') === input.val()) return;
+            input.data('term', input.val());
+            clearTimeout(timeout);
+            timeout = setTimeout(function() {
+                searchChoices(url, input, false);
+            }, $.fn.updateFields.delay);
+        }).delegate('a.' + MORE_CLASS, 'click', function(event) {
+            event.preventDefault();
+            searchChoices(url, $(this).prevAll('input.' + SEARCH_CLASS).first(), true);
+        });
     };
 
     var DATA_ORIGINAL_HREF = 'data-original-href';
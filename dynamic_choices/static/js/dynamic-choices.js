@@ -1,6 +1,7 @@
 ($ || jQuery || django.jQuery)(function($) {
-    var DATA_BOUND_FIELDS = 'data-dynamic-choices-bound-fields',
-        DATA_FORMSET = 'data-dynamic-choices-formset';
+    var DATA_FORMSET = 'data-dynamic-choices-formset',
+        DATA_CACHE = 'data-dynamic-choices-cache',
+        DATA_STATE = 'dynamicChoicesState';
 
     var error = (function() {
         if ('console' in window && $.isFunction(console.error))
@@ -18,79 +19,336 @@
         }).toArray();
     }
 
-    $.fn.updateFields = function(url, form) {
+    // Return the inputs the choices of the specified fields are evaluated
+    // from or null if they're unknown for one of them.
+    function getInputs(form, fields) {
+        var inputs = $.fn.updateFields.inputs,
+            selectors = [];
+        for (var i = 0; i < fields.length; i++) {
+            var name = fields[i].name,
+                fieldInputs = inputs.fields[name],
+                match = name.match(/^([\w_]+)-(\w+)-([\w_]+)$/);
+            if (!fieldInputs && match) {
+                var templates = (inputs.inlines[match[1]] || {})[match[3]];
+                if (templates) fieldInputs = $.map(templates, function(template) {
+                    return template.replace(/\{index\}/g, match[2]);
+                });
+            }
+            if (!fieldInputs) return null;
+            selectors.push.apply(selectors, fieldInputs);
+        }
+        return selectors.length ? form.find(selectors.join(', ')) : $();
+    }
+
+    // Bounded cache of choices responses evicting the least recently used
+    // ones and the ones older than ttl milliseconds.
+    function ChoicesCache(size, ttl) {
+        this.size = size;
+        this.ttl = ttl;
+        this.clear();
+    }
+
+    ChoicesCache.prototype = {
+        clear: function() {
+            this.keys = [];
+            this.entries = {};
+        },
+        remove: function(key) {
+            this.keys.splice($.inArray(key, this.keys), 1);
+            delete this.entries[key];
+        },
+        get: function(key) {
+            if (!this.entries.hasOwnProperty(key)) return;
+            var entry = this.entries[key];
+            this.remove(key);
+            if (this.ttl && new Date().getTime() - entry.time > this.ttl) return;
+            this.keys.push(key);
+            this.entries[key] = entry;
+            return entry.value;
+        },
+        set: function(key, value) {
+            if (this.entries.hasOwnProperty(key)) this.remove(key);
+            this.keys.push(key);
+            this.entries[key] = {
+                value: value,
+                time: new Date().getTime()
+            };
+            while (this.keys.length > this.size) this.remove(this.keys[0]);
+        }
+    };
+
+    // Whether or not the choices of the specified fields can be cached.
+    function isCacheable(fields) {
+        if (!$.fn.updateFields.cache.size) return false;
+        for (var i = 0; i < fields.length; i++) {
+            if ($(fields[i]).attr(DATA_CACHE) === 'false') return false;
+        }
+        return true;
+    }
+
+    // Decode the compact choices format where widget names and group labels
+    // are deduplicated and choices are sent as segments of parallel values
+    // and labels arrays along with their group index, -1 when ungrouped.
+    // Streamed segments continuing the previous group have a truthy fourth
+    // item.
+    function decodeChoices(json) {
+        var decoded = {};
+        for (var name in json.fields) {
+            var field = json.fields[name],
+                segments = field[1],
+                value = [];
+            for (var i = 0; i < segments.length; i++) {
+                var segment = segments[i],
+                    values = segment[1],
+                    labels = segment[2],
+                    choices;
+                if (segment[0] === -1) choices = value;
+                else if (segment[3]) choices = value[value.length - 1][1];
+                else value.push([json.groups[segment[0]], choices = []]);
+                for (var j = 0; j < values.length; j++) choices.push([values[j], labels[j]]);
+            }
+            decoded[name] = {
+                widget: json.widgets[field[0]],
+                value: value
+            };
+        }
+        return decoded;
+    }
+
+    function applyChoices(form, json) {
         var handlers = $.fn.updateFields.widgetHandlers;
+        for (var name in json) {
+            var field = form.find('[name="' + name + '"]')[0],
+                data = json[name];
+            if (!field) continue;
+            if (data.widget in handlers) {
+                handlers[data.widget](field, data.value);
+                $(field).trigger('change', {
+                    'triggeredByDynamicChoices': true
+                });
+            } else error('Missing handler for "' + data.widget + '" widget.');
+        }
+    }
+
+    function sendQuery(url, form, inputs, query) {
+        var type = 'GET';
+        // Make sure large payloads don't hit URL length limits
+        if (query.length > $.fn.updateFields.maxQueryLength) {
+            type = 'POST';
+            if (inputs) query += '&' + $.param(form.find('[name="csrfmiddlewaretoken"]').serializeArray());
+        }
+        return $.ajax({
+            url: url,
+            type: type,
+            data: query,
+            dataType: 'json'
+        });
+    }
+
+    function requestChoices(url, form, state) {
+        var fields = state.fields,
+            sequence = ++state.sequence;
+        state.timeout = null;
+        state.fields = $();
+        // Superseded requests are aborted and their fields requested again
+        var superseded = state.xhr;
+        if (superseded) {
+            state.xhr = null;
+            fields = fields.add(superseded.fields);
+            superseded.abort();
+        }
+        var inputs = getInputs(form, fields),
+            data = (inputs ? inputs : form).serializeArray();
+        data.push({
+            name: 'DYNAMIC_CHOICES_FIELDS',
+            value: getFieldNames(fields).join(',')
+        });
+        // Make sure fields depending on these ones, transitively, are
+        // updated from the same response.
+        data.push({
+            name: 'DYNAMIC_CHOICES_CASCADE',
+            value: 1
+        }, {
+            name: 'DYNAMIC_CHOICES_FORMAT',
+            value: 'compact'
+        });
+        var query = $.param(data),
+            cache = $.fn.updateFields.cache,
+            cacheKey = url + '?' + query,
+            cacheable = isCacheable(fields);
+        if (cacheable) {
+            var json = cache.get(cacheKey);
+            if (json) {
+                applyChoices(form, json);
+                fields.removeClass('loading');
+                return;
+            }
+        }
+        var xhr = state.xhr = sendQuery(url, form, inputs, query).done(function(json) {
+            // Make sure the last change wins
+            if (sequence !== state.sequence) return;
+            json = decodeChoices(json);
+            if (cacheable && isCacheable(form.find($.map(json, function(data, name) {
+                return '[name="' + name + '"]';
+            }).join(', ')))) cache.set(cacheKey, json);
+            applyChoices(form, json);
+        }).always(function() {
+            if (state.xhr !== xhr) return;
+            state.xhr = null;
+            fields.removeClass('loading');
+        });
+        xhr.fields = fields;
+    }
+
+    $.fn.updateFields = function(url, form) {
         if (this.length) {
             form = $(form ? form : this[0].form);
-            var fields = $(this).addClass('loading'),
-                data = $(form).serializeArray(),
-                boundFields = [];
-            // Make sure fields bound to these ones are updated right after
-            fields.each(function(i, field) {
-                var selector = $(field).attr(DATA_BOUND_FIELDS);
-                if (selector) boundFields.push(selector);
-                var formset = $(field).closest('[' + DATA_FORMSET + ']').attr(DATA_FORMSET);
-                if (formset) boundFields.push($.fn.bindFieldset.formsetsBindings[formset](field));
-            });
-            fields.addClass('loading');
-            data.push({
-                name: 'DYNAMIC_CHOICES_FIELDS',
-                value: getFieldNames(fields).join(',')
-            });
-            $.getJSON(url, $.param(data), function(json) {
-                fields.each(function(index, field) {
-                    if (field.name in json) {
-                        var data = json[field.name];
-                        if (data.widget in handlers) {
-                            handlers[data.widget](field, data.value);
-                            $(field).trigger('change', {
-                                'triggeredByDynamicChoices': true
-                            });
-                        } else error('Missing handler for "' + data.widget + '" widget.');
-                    }
-                    $(field).removeClass('loading');
-                });
-                $(boundFields.join(', ')).updateFields(url, form);
+            var state = form.data(DATA_STATE);
+            if (!state) form.data(DATA_STATE, state = {
+                fields: $(),
+                sequence: 0,
+                timeout: null,
+                xhr: null
             });
+            // Coalesce rapid changes into a single request
+            state.fields = state.fields.add($(this).addClass('loading'));
+            clearTimeout(state.timeout);
+            state.timeout = setTimeout(function() {
+                requestChoices(url, form, state);
+            }, $.fn.updateFields.delay);
         }
         return this;
     };
 
+    // Request the page of the choices of a searchable field matching term
+    // following cursor, resolves to an object with the choices and the
+    // cursor of the next page which is null on the last one.
+    $.fn.searchChoices = function(url, term, cursor) {
+        var form = $(this[0].form),
+            inputs = getInputs(form, this),
+            data = (inputs ? inputs : form).serializeArray();
+        data.push({
+            name: 'DYNAMIC_CHOICES_SEARCH',
+            value: this[0].name
+        }, {
+            name: 'DYNAMIC_CHOICES_TERM',
+            value: term
+        });
+        if (cursor !== null && cursor !== undefined) data.push({
+            name: 'DYNAMIC_CHOICES_CURSOR',
+            value: cursor
+        });
+        return sendQuery(url, form, inputs, $.param(data));
+    };
+
+    function isGroup(option) {
+        return $.isArray(option[1]);
+    }
+
+    function optionKey(option) {
+        return isGroup(option) ? ['optgroup', option[0]].join('\u0000') : ['option', option[0], option[1]].join('\u0000');
+    }
+
+    function nodeKey(node) {
+        return node.nodeName === 'OPTGROUP' ? ['optgroup', node.label].join('\u0000') : ['option', node.value, node.text].join('\u0000');
+    }
+
+    function childElements(element) {
+        var elements = [];
+        for (var node = element.firstChild; node; node = node.nextSibling) {
+            if (node.nodeType === 1) elements.push(node);
+        }
+        return elements;
+    }
+
+    // Whether or not the nodes already represent the specified options.
+    function matchOptions(nodes, options) {
+        if (nodes.length !== options.length) return false;
+        for (var i = 0; i < options.length; i++) {
+            if (nodeKey(nodes[i]) !== optionKey(options[i])) return false;
+            if (isGroup(options[i]) && !matchOptions(childElements(nodes[i]), options[i][1])) return false;
+        }
+        return true;
+    }
+
+    // Replace the options of element, a select or an optgroup, reusing its
+    // matching option elements and building the new ones off-document.
     function assignOptions(element, options) {
-        $(options).each(function(index, option) {
-            if ($.isArray(option[1])) {
-                var optGroup = $('<optgroup></optgroup>').attr({
-                    label: option[0]
-                });
-                assignOptions(optGroup, option[1]);
-                element.append(optGroup);
-            } else {
-                element.append($('<option></option>').attr({
-                    value: option[0]
-                }).html(option[1]));
+        element = $(element)[0];
+        var nodes = childElements(element);
+        if (matchOptions(nodes, options)) return;
+
+        var reusable = {};
+        for (var i = 0; i < nodes.length; i++) {
+            var key = nodeKey(nodes[i]);
+            if (!reusable.hasOwnProperty(key)) reusable[key] = [];
+            reusable[key].push(nodes[i]);
+        }
+
+        var fragment = document.createDocumentFragment();
+        for (var i = 0; i < options.length; i++) {
+            var option = options[i],
+                key = optionKey(option),
+                node = reusable.hasOwnProperty(key) ? reusable[key].shift() : null;
+            if (!node) {
+                if (isGroup(option)) {
+                    node = document.createElement('optgroup');
+                    node.label = option[0];
+                } else {
+                    node = document.createElement('option');
+                    node.value = option[0];
+                    node.text = option[1];
+                }
             }
-        });
+            fragment.appendChild(node);
+            if (isGroup(option)) assignOptions(node, option[1]);
+        }
+
+        while (element.firstChild) element.removeChild(element.firstChild);
+        element.appendChild(fragment);
     }
 
     function selectWidgetHandler(select, options) {
         select = $(select);
         var value = select.val();
-        select.empty();
         assignOptions(select, options);
         select.val(value);
+        // Values that aren't valid choices anymore are cleared
+        if (select.val() === null) select.val('');
     }
 
     $.fn.updateFields.widgetHandlers = {
         'default': selectWidgetHandler
     };
 
+    // Exposed for widget handlers managing their own select elements.
+    $.fn.updateFields.assignOptions = assignOptions;
+
+    // Inputs the choices of dynamic fields, by name, and of inline dynamic
+    // fields, by formset and name with an {index} placeholder, depend on.
+    $.fn.updateFields.inputs = {
+        fields: {},
+        inlines: {}
+    };
+
+    // Choices are requested through POST past this query string length.
+    $.fn.updateFields.maxQueryLength = 2000;
+
+    // Milliseconds to wait for subsequent changes before requesting choices.
+    $.fn.updateFields.delay = 100;
+
+    // Cache of the choices responses, its size and ttl can be adjusted and
+    // setting its size to 0 disables it. Fields with a
+    // data-dynamic-choices-cache="false" attribute are never cached.
+    $.fn.updateFields.cache = new ChoicesCache(50, 5 * 60 * 1000);
+
     $.fn.bindFields = function(url, fields) {
         var handlers = $.fn.bindFields.widgetHandlers;
         return this.each(function(index, field) {
             $(field).change(function(event, data) {
                 if (data && 'triggeredByDynamicChoices' in data) return;
                 $(fields).updateFields(url, field.form);
-            }).attr(DATA_BOUND_FIELDS, fields);
+            });
         });
     };
 
@@ -125,9 +383,6 @@
     $.fn.bindFieldset = function(url, fieldset, fields, extractor, builder) {
         extractor = $.isFunction(extractor) ? extractor : defaultFieldNameExtractor;
         builder = $.isFunction(builder) ? builder : defaultFieldSelectorBuilder;
-        $.fn.bindFieldset.formsetsBindings[fieldset] = function(field) {
-            return formsetFieldBoundFields(fieldset, field, fields, extractor, builder);
-        };
         return this.each(function(index, container) {
             $(container).change(function(event, data) {
                 if (data && 'triggeredByDynamicChoices' in data) return;
@@ -137,5 +392,4 @@
             }).attr(DATA_FORMSET, fieldset);
         });
     };
-    $.fn.bindFieldset.formsetsBindings = {};
 });
\ No newline at end of file
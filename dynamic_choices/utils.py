@@ -3,6 +3,21 @@ from __future__ import unicode_literals
 from django.template.loader import get_template
 from django.template.loader_tags import ExtendsNode
 
+try:
+    from django.core.cache import caches
+except ImportError:  # Django < 1.7
+    from django.core.cache import get_cache
+else:
+    def get_cache(alias):
+        return caches[alias]
+
+try:
+    from django.apps import apps
+except ImportError:  # Django < 1.7
+    from django.db.models import get_models
+else:
+    get_models = apps.get_models
+
 
 def template_extends(template_name, expected_parent_name):
     """Returns whether or not a template extends the specified parent"""
@@ -5,7 +5,7 @@ from django.contrib import admin
 from dynamic_choices.admin import DynamicAdmin
 
 from .forms import UserDefinedForm
-from .models import Master, Puppet
+from .models import Master, Puppet, Show
 
 
 class EnemyInline(admin.TabularInline):
@@ -26,3 +26,4 @@ class MasterAdmin(DynamicAdmin):
 site = admin.AdminSite('admin')
 site.register(Puppet, PuppetAdmin)
 site.register(Master, MasterAdmin)
+site.register(Show, DynamicAdmin)
@@ -80,10 +80,40 @@ class Puppet(models.Model):
         return queryset
 
 
+class Marionette(Puppet):
+    strings = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+
+
+class Apprentice(models.Model):
+    alignment = models.SmallIntegerField(choices=ALIGNMENT_CHOICES)
+    master = DynamicChoicesForeignKey(Master, choices=same_alignment, cache_choices=300)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+
+
+class Pupil(models.Model):
+    level = models.SmallIntegerField(choices=ALIGNMENT_CHOICES)
+    master = DynamicChoicesForeignKey(Master, choices='choices_for_master', cache_choices=300)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+
+    def choices_for_master(self, queryset):
+        return queryset.filter(alignment=self.level)
+
+
 class Enemy(models.Model):
     puppet = DynamicChoicesForeignKey(Puppet)
-    enemy = DynamicChoicesForeignKey(Puppet, choices='choices_for_enemy', related_name='+')
-    because_of = DynamicChoicesForeignKey(Master, choices='choices_for_because_of', related_name='becauses_of')
+    enemy = DynamicChoicesForeignKey(
+        Puppet, choices='choices_for_enemy', related_name='+', choices_use_instance=False
+    )
+    because_of = DynamicChoicesForeignKey(
+        Master, choices='choices_for_because_of', related_name='becauses_of', choices_use_instance=False
+    )
     since = models.DateField()
 
     class Meta:
@@ -99,3 +129,49 @@ class Enemy(models.Model):
             (label, queryset.filter(alignment=alignment))
             for alignment, label in ALIGNMENT_CHOICES if alignment != puppet__alignment
         ]
+
+
+class Stage(models.Model):
+    alignment = models.SmallIntegerField(choices=ALIGNMENT_CHOICES)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+        ordering = ('-pk',)
+
+
+class Animal(models.Model):
+    name = models.CharField(max_length=50)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+        ordering = ('name',)
+
+
+class Dog(Animal):
+    size = models.PositiveSmallIntegerField()
+
+    class Meta:
+        app_label = 'dynamic_choices'
+        ordering = ('name',)
+
+
+@python_2_unicode_compatible
+class Trick(models.Model):
+    name = models.CharField(max_length=50)
+    alignment = models.SmallIntegerField(choices=ALIGNMENT_CHOICES)
+
+    class Meta:
+        app_label = 'dynamic_choices'
+
+    def __str__(self):
+        return self.name
+
+
+class Show(models.Model):
+    alignment = models.SmallIntegerField(choices=ALIGNMENT_CHOICES)
+    trick = DynamicChoicesForeignKey(
+        Trick, choices=same_alignment, search_fields=('name',), search_page_size=2, choices_label='name'
+    )
+
+    class Meta:
+        app_label = 'dynamic_choices'
@@ -1,22 +1,31 @@
 from __future__ import unicode_literals
 
+import gzip
+import io
 import json
 import os
+import zlib
 
+from django.contrib.auth.models import User
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.test import SimpleTestCase, TestCase
-from django.test.client import Client
-from django.test.utils import override_settings
+from django.test.client import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import translation
 from django.utils.encoding import force_text
 
-from dynamic_choices.admin import DynamicAdmin
+from dynamic_choices.admin import DynamicAdmin, iter_dynamic_choices_json
 from dynamic_choices.forms import DynamicModelForm
 from dynamic_choices.forms.fields import (
     DynamicModelChoiceField, DynamicModelMultipleChoiceField,
 )
+from dynamic_choices.utils import get_cache
 
-from .admin import PuppetAdmin
-from .models import ALIGNMENT_GOOD, Master, Puppet
+from .admin import PuppetAdmin, site
+from .models import (
+    ALIGNMENT_EVIL, ALIGNMENT_GOOD, Master, Puppet, Show, Trick,
+)
 
 MODULE_PATH = os.path.abspath(os.path.dirname(__file__))
 
@@ -234,3 +243,369 @@ class AdminChoicesTests(AdminTestBase):
             ['Evil', [[2, 'Evil puppet (2)'], ]],
             ['Neutral', []],
         ])
+
+    def test_only_requested_fields(self):
+        """Make sure formsets contributing no requested field are skipped"""
+        response = self.client.get('/admin/dynamic_choices/puppet/1/choices/', {
+            'DYNAMIC_CHOICES_FIELDS': 'master',
+            'alignment': ALIGNMENT_GOOD,
+        })
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(list(data), ['master'])
+        self.assertEqual(data['master']['value'], [['', '---------'], [1, 'Good master (1)']])
+
+    def test_only_requested_row(self):
+        """Make sure only the requested formset row is built"""
+        data = {
+            'DYNAMIC_CHOICES_FIELDS': 'enemy_set-2-because_of',
+            'enemy_set-TOTAL_FORMS': 3,
+            'enemy_set-INITIAL_FORMS': 1,
+            'enemy_set-0-id': 1,
+            'enemy_set-0-enemy': 1,
+            'enemy_set-2-enemy': 2,
+        }
+        # Building the bound row 0 would also fetch the existing enemies
+        with self.assertNumQueries(7):
+            response = self._get_choices(data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(data, {
+            'enemy_set-2-because_of': {'widget': 'default', 'value': [['', '---------'], [2, 'Evil master (2)']]},
+        })
+
+    def test_cascade(self):
+        """Make sure fields depending on the requested ones are evaluated as well"""
+        data = {
+            'DYNAMIC_CHOICES_FIELDS': 'master,enemy_set-0-enemy',
+            'DYNAMIC_CHOICES_CASCADE': 1,
+            'alignment': ALIGNMENT_GOOD,
+            'enemy_set-TOTAL_FORMS': 1,
+            'enemy_set-0-enemy': 2,
+        }
+        response = self._get_choices(data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(set(data), set(['master', 'enemy_set-0-enemy', 'enemy_set-0-because_of']))
+        self.assertEqual(data['enemy_set-0-because_of']['value'], [['', '---------'], [2, 'Evil master (2)']])
+
+    def test_POST_minimal_inputs(self):
+        """Make sure choices can be requested through POST from their inputs only"""
+        response = self.client.post('/admin/dynamic_choices/puppet/1/choices/', {
+            'DYNAMIC_CHOICES_FIELDS': 'enemy_set-1-because_of',
+            'DYNAMIC_CHOICES_CASCADE': 1,
+            'enemy_set-TOTAL_FORMS': 2,
+            'enemy_set-INITIAL_FORMS': 1,
+            'enemy_set-1-id': '',
+            'enemy_set-1-enemy': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(data, {
+            'enemy_set-1-because_of': {'widget': 'default', 'value': [['', '---------'], [2, 'Evil master (2)']]},
+        })
+
+    def test_cascade_invalidated_value(self):
+        """Make sure values that are no longer valid choices are ignored by dependents"""
+        data = {
+            'DYNAMIC_CHOICES_FIELDS': 'enemy_set-0-enemy',
+            'DYNAMIC_CHOICES_CASCADE': 1,
+            'alignment': ALIGNMENT_GOOD,
+            'enemy_set-TOTAL_FORMS': 1,
+            'enemy_set-0-enemy': 1,
+        }
+        response = self._get_choices(data)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(data['enemy_set-0-because_of']['value'], [['', '---------']])
+
+
+class AdminChoicesEncodingTests(AdminTestBase):
+    url = '/admin/dynamic_choices/puppet/1/choices/'
+
+    def test_compact_format(self):
+        response = self.client.get(self.url, {
+            'DYNAMIC_CHOICES_FIELDS': 'master,enemy_set-__prefix__-enemy',
+            'DYNAMIC_CHOICES_FORMAT': 'compact',
+            'alignment': ALIGNMENT_GOOD,
+            'enemy_set-TOTAL_FORMS': 0,
+            'enemy_set-INITIAL_FORMS': 0,
+        })
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(force_text(response.content))
+        self.assertEqual(data['widgets'], ['default'])
+        self.assertEqual(data['groups'], ['Evil', 'Neutral'])
+        self.assertEqual(data['fields'], {
+            'master': [0, [[-1, ['', 1], ['---------', 'Good master (1)']]]],
+            'enemy_set-__prefix__-enemy': [0, [
+                [-1, [''], ['---------']], [0, [2], ['Evil puppet (2)']], [1, [], []],
+            ]],
+        })
+
+    def test_compressed(self):
+        data = {
+            'enemy_set-TOTAL_FORMS': 0,
+            'enemy_set-INITIAL_FORMS': 0,
+        }
+        response = self.client.get(self.url, data)
+        compressed = self.client.get(self.url, data, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed['Vary'])
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed.content)).read(), response.content)
+        compressed = self.client.get(self.url, data, HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(compressed.content), response.content)
+
+    def test_not_accepted(self):
+        response = self.client.get(self.url, {
+            'enemy_set-TOTAL_FORMS': 0,
+            'enemy_set-INITIAL_FORMS': 0,
+        }, HTTP_ACCEPT_ENCODING='identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class AdminChoicesStreamingTests(AdminTestBase):
+    url = '/admin/dynamic_choices/puppet/1/choices/'
+    data = {
+        'alignment': ALIGNMENT_GOOD,
+        'enemy_set-TOTAL_FORMS': 1,
+        'enemy_set-INITIAL_FORMS': 0,
+        'enemy_set-0-enemy': 2,
+    }
+
+    def setUp(self):
+        super(AdminChoicesStreamingTests, self).setUp()
+        self.admin = site._registry[Puppet]
+
+    def tearDown(self):
+        self.admin.dynamic_choices_stream = False
+
+    def _get_choices(self, data, **extra):
+        self.admin.dynamic_choices_stream = False
+        response = self.client.get(self.url, data, **extra)
+        self.assertFalse(response.streaming)
+        self.admin.dynamic_choices_stream = True
+        streamed_response = self.client.get(self.url, data, **extra)
+        self.assertTrue(streamed_response.streaming)
+        return response.content, b''.join(streamed_response.streaming_content)
+
+    def test_streamed(self):
+        content, streamed_content = self._get_choices(self.data)
+        self.assertEqual(json.loads(force_text(streamed_content)), json.loads(force_text(content)))
+
+    def test_compact(self):
+        content, streamed_content = self._get_choices(dict(self.data, DYNAMIC_CHOICES_FORMAT='compact'))
+        self.assertEqual(json.loads(force_text(streamed_content)), json.loads(force_text(content)))
+
+    def test_compressed(self):
+        content, streamed_content = self._get_choices(self.data, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(
+            json.loads(force_text(gzip.GzipFile(fileobj=io.BytesIO(streamed_content)).read())),
+            json.loads(force_text(gzip.GzipFile(fileobj=io.BytesIO(content)).read()))
+        )
+
+    def test_cascade(self):
+        content, streamed_content = self._get_choices(dict(
+            self.data, DYNAMIC_CHOICES_FIELDS='master,enemy_set-0-enemy', DYNAMIC_CHOICES_CASCADE=1, master=1
+        ))
+        self.assertEqual(json.loads(force_text(streamed_content)), json.loads(force_text(content)))
+
+    def test_cascade_streamed_lazily(self):
+        self.admin.dynamic_choices_stream = True
+        response = self.client.get(self.url, dict(
+            self.data, DYNAMIC_CHOICES_FIELDS='master,enemy_set-0-enemy', DYNAMIC_CHOICES_CASCADE=1, master=1
+        ))
+        # The enemy choices are checked since because_of depends on them
+        # while the master and because_of ones, along with the enemy
+        # alignment, are fetched while streamed.
+        with self.assertNumQueries(3):
+            data = json.loads(force_text(b''.join(response.streaming_content)))
+        self.assertEqual(set(data), set(['master', 'enemy_set-0-enemy', 'enemy_set-0-because_of']))
+
+    def test_segments(self):
+        data = {
+            'friends': {'widget': 'default', 'value': [
+                ('', '---------'), ('Good', [(1, 'a'), (2, 'b'), (3, 'c')]), ('Neutral', []),
+            ]},
+        }
+        chunks = list(iter_dynamic_choices_json(data, compact=True, chunk_size=1, segment_size=2))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(json.loads(''.join(chunks)), {
+            'fields': {'friends': [0, [
+                [-1, [''], ['---------']], [0, [1, 2], ['a', 'b']], [0, [3], ['c'], 1], [1, [], []],
+            ]]},
+            'widgets': ['default'],
+            'groups': ['Good', 'Neutral'],
+        })
+
+
+class DynamicChoicesBinderTests(AdminTestBase):
+
+    def test_binder(self):
+        response = self.client.get('/admin/dynamic_choices/puppet/1/')
+        binder = response.context['dynamic_choices_binder']
+        self.assertTrue(binder.startswith('django.dynamicAdmin(') and binder.endswith(');'))
+        fields, inlines, inputs = json.loads('[%s]' % binder[len('django.dynamicAdmin('):-len(');')])
+        self.assertEqual(fields, {
+            "[name='alignment']": ["[name='friends']", "[name='master']", "[name^='enemy_set-'][name$='-enemy']"],
+        })
+        self.assertEqual(inlines, {'enemy_set': {'enemy': ['because_of']}})
+        self.assertEqual(inputs['fields'], {
+            'friends': ["[name='alignment']"],
+            'master': ["[name='alignment']"],
+            'secret_lover': [],
+        })
+        self.assertEqual(inputs['inlines']['enemy_set']['enemy'], [
+            "[name='alignment']",
+            "[name='enemy_set-INITIAL_FORMS']",
+            "[name='enemy_set-TOTAL_FORMS']",
+            "[name='enemy_set-{index}-enemy']",
+            "[name='enemy_set-{index}-id']",
+        ])
+
+    def test_cached_binder(self):
+        request = RequestFactory().get('/admin/dynamic_choices/puppet/1/')
+        request.user = User.objects.get(username='superuser')
+        admin = site._registry[Puppet]
+        binder = admin.get_dynamic_choices_binder(request)
+        self.assertIs(admin.get_dynamic_choices_binder(request), binder)
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dynamic-choices-tests',
+    }
+})
+class AdminChoicesCacheTests(AdminTestBase):
+    url = '/admin/dynamic_choices/puppet/1/choices/'
+    data = {
+        'DYNAMIC_CHOICES_FIELDS': 'master',
+        'alignment': ALIGNMENT_GOOD,
+    }
+
+    def setUp(self):
+        super(AdminChoicesCacheTests, self).setUp()
+        self.admin = site._registry[Puppet]
+        self.admin.dynamic_choices_cache_timeout = 60
+        get_cache('default').clear()
+
+    def tearDown(self):
+        del self.admin.dynamic_choices_cache_timeout
+
+    def test_disabled(self):
+        self.admin.dynamic_choices_cache_timeout = None
+        response = self.client.get(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertIn('max-age=0', response['Cache-Control'])
+
+    def test_cached_response(self):
+        response = self.client.get(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('ETag'))
+        # Only the session and user are retrieved on cache hits
+        with self.assertNumQueries(2):
+            cached_response = self.client.get(self.url, self.data)
+        self.assertEqual(cached_response.status_code, 200)
+        self.assertEqual(cached_response.content, response.content)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+    def test_distinct_values(self):
+        response = self.client.get(self.url, self.data)
+        other_response = self.client.get(self.url, dict(self.data, alignment=ALIGNMENT_EVIL))
+        self.assertNotEqual(other_response['ETag'], response['ETag'])
+        data = json.loads(force_text(other_response.content))
+        self.assertEqual(data['master']['value'], [['', '---------'], [2, 'Evil master (2)']])
+
+    def test_language(self):
+        response = self.client.get(self.url, self.data)
+        with translation.override('fr'):
+            # The choices of another language are not served from the cache
+            with CaptureQueriesContext(connection) as queries:
+                other_response = self.client.get(self.url, self.data)
+            self.assertGreater(len(queries), 2)
+            with self.assertNumQueries(2):
+                self.client.get(self.url, self.data)
+        self.assertEqual(other_response.content, response.content)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, self.data)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, self.data, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_compressed_weak_etag(self):
+        data = {
+            'enemy_set-TOTAL_FORMS': 0,
+            'enemy_set-INITIAL_FORMS': 0,
+        }
+        response = self.client.get(self.url, data)
+        compressed = self.client.get(self.url, data, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['ETag'], 'W/%s' % response['ETag'])
+        response = self.client.get(
+            self.url, data, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+class AdminSearchChoicesTests(AdminTestBase):
+    url = '/admin/dynamic_choices/show/add/choices/'
+
+    def setUp(self):
+        super(AdminSearchChoicesTests, self).setUp()
+        self.tricks = [
+            Trick.objects.create(name=name, alignment=alignment) for name, alignment in [
+                ('Card trick', ALIGNMENT_GOOD), ('Coin trick', ALIGNMENT_GOOD),
+                ('Rope trick', ALIGNMENT_GOOD), ('Card fraud', ALIGNMENT_EVIL),
+            ]
+        ]
+
+    def _search(self, data):
+        response = self.client.get(self.url, data)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(force_text(response.content))
+
+    def test_search(self):
+        data = self._search({
+            'DYNAMIC_CHOICES_SEARCH': 'trick',
+            'DYNAMIC_CHOICES_TERM': 'card',
+            'alignment': ALIGNMENT_EVIL,
+        })
+        self.assertEqual(data, {'choices': [[self.tricks[3].pk, 'Card fraud']], 'cursor': None})
+
+    def test_cursor(self):
+        data = {
+            'DYNAMIC_CHOICES_SEARCH': 'trick',
+            'alignment': ALIGNMENT_GOOD,
+        }
+        page = self._search(data)
+        self.assertEqual(page['choices'], [[self.tricks[0].pk, 'Card trick'], [self.tricks[1].pk, 'Coin trick']])
+        page = self._search(dict(data, DYNAMIC_CHOICES_CURSOR=page['cursor']))
+        self.assertEqual(page, {'choices': [[self.tricks[2].pk, 'Rope trick']], 'cursor': None})
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {
+            'DYNAMIC_CHOICES_SEARCH': 'trick',
+            'DYNAMIC_CHOICES_CURSOR': 'invalid',
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_searchable(self):
+        response = self.client.get(self.url, {'DYNAMIC_CHOICES_SEARCH': 'alignment'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_selected_choice_only(self):
+        show = Show.objects.create(alignment=ALIGNMENT_GOOD, trick=self.tricks[0])
+        response = self.client.get('/admin/dynamic_choices/show/%d/' % show.pk)
+        self.assertContains(response, 'data-dynamic-choices-search="true"')
+        self.assertContains(response, 'Card trick')
+        self.assertNotContains(response, 'Coin trick')
+        data = json.loads(force_text(self.client.get('/admin/dynamic_choices/show/%d/choices/' % show.pk, {
+            'DYNAMIC_CHOICES_FIELDS': 'trick',
+            'alignment': ALIGNMENT_EVIL,
+            'trick': self.tricks[0].pk,
+        }).content))
+        self.assertEqual(data['trick']['value'], [['', '---------']])
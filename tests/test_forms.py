@@ -0,0 +1,269 @@
+from __future__ import unicode_literals
+
+import datetime
+import inspect
+
+import django
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from dynamic_choices.db.query import identity_map
+from dynamic_choices.forms import DynamicModelForm
+
+from .models import ALIGNMENT_EVIL, ALIGNMENT_GOOD, Enemy, Puppet, Show, Trick
+
+try:
+    from unittest import skipIf
+except ImportError:  # Python 2.6
+    from django.utils.unittest import skipIf
+
+
+class EnemyForm(DynamicModelForm):
+    class Meta:
+        model = Enemy
+        fields = ('puppet', 'enemy', 'because_of')
+
+
+class PuppetForm(DynamicModelForm):
+    class Meta:
+        model = Puppet
+        fields = ('alignment', 'secret_lover')
+
+
+class ShowForm(DynamicModelForm):
+    class Meta:
+        model = Show
+        fields = ('alignment', 'trick')
+
+
+class GroupedChoicesTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def test_single_query(self):
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        choices = form.fields['enemy'].widget.choices
+        with self.assertNumQueries(1):
+            self.assertEqual(len(choices), 1)
+            self.assertEqual(list(choices), [
+                ('', '---------'),
+                ('Evil', [(2, 'Evil puppet (2)')]),
+                ('Neutral', []),
+            ])
+            str(form['enemy'])
+
+    def test_iter_choices(self):
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        field = form.fields['enemy']
+        with self.assertNumQueries(1):
+            choices = [
+                (value, list(label) if inspect.isgenerator(label) else label)
+                for value, label in field.iter_choices()
+            ]
+        self.assertEqual(choices, list(field.widget.choices))
+
+    def test_iter_choices_ordered_model(self):
+        ordering = Puppet._meta.ordering
+        Puppet._meta.ordering = ['pk']
+        self.addCleanup(setattr, Puppet._meta, 'ordering', ordering)
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        choices = [
+            (value, list(label) if inspect.isgenerator(label) else label)
+            for value, label in form.fields['enemy'].iter_choices()
+        ]
+        self.assertEqual(choices, [
+            ('', '---------'),
+            ('Evil', [(2, 'Evil puppet (2)')]),
+            ('Neutral', []),
+        ])
+
+    def test_grouped_choices_reset(self):
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        field = form.fields['enemy']
+        self.assertEqual(len(field.widget.choices), 1)
+        field.set_choice_data(form.instance, {'puppet__alignment': ALIGNMENT_EVIL})
+        self.assertEqual(
+            [choice for _label, choices in list(field.widget.choices)[1:] for choice, _label in choices],
+            list(Puppet.objects.exclude(alignment=ALIGNMENT_EVIL).values_list('pk', flat=True))
+        )
+
+
+class LazyChoicesTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def test_deferred_evaluation(self):
+        with self.assertNumQueries(0):
+            form = EnemyForm(initial={'enemy': 2})
+        field = form.fields['because_of']
+        # Resolving enemy__alignment and fetching the choices.
+        with self.assertNumQueries(2):
+            self.assertEqual([choice for choice, _label in field.widget.choices], ['', 2])
+        with self.assertNumQueries(1):
+            self.assertEqual(field.clean(2).pk, 2)
+
+    def test_set_choice_data_resets(self):
+        form = EnemyForm(initial={'enemy': 2})
+        field = form.fields['because_of']
+        self.assertEqual([choice for choice, _label in field.widget.choices], ['', 2])
+        field.set_choice_data(form.instance, {'enemy': 1})
+        self.assertEqual([choice for choice, _label in field.widget.choices], ['', 1])
+
+
+class MemoizedChoicesTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def test_shared_choices(self):
+        with identity_map():
+            forms = [EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD, 'enemy': 2}) for _ in range(3)]
+        with self.assertNumQueries(1):
+            for form in forms:
+                self.assertEqual(len(form.fields['enemy'].widget.choices), 1)
+        # Resolving enemy__alignment and fetching the choices.
+        with self.assertNumQueries(2):
+            for form in forms:
+                self.assertEqual([choice for choice, _label in form.fields['because_of'].widget.choices], ['', 2])
+
+    def test_saved_instances_shared_choices(self):
+        puppet, enemy = Puppet.objects.get(pk=1), Puppet.objects.get(pk=2)
+        enemies = [
+            Enemy.objects.create(puppet=puppet, enemy=enemy, because_of_id=2, since=datetime.date.today())
+            for _ in range(3)
+        ]
+        with identity_map():
+            forms = [EnemyForm(instance=instance) for instance in enemies]
+        # Resolving puppet__alignment and fetching the choices.
+        with self.assertNumQueries(2):
+            for form in forms:
+                self.assertEqual(len(form.fields['enemy'].widget.choices), 1)
+
+    def test_instance_callbacks(self):
+        """Callbacks defined as methods are not shared among different instances"""
+        with identity_map():
+            forms = [PuppetForm(instance=puppet) for puppet in Puppet.objects.all()]
+        choices = [list(form.fields['secret_lover'].widget.choices) for form in forms]
+        self.assertEqual(choices[0], choices[1])
+        Puppet.objects.filter(pk=2).update(secret_lover=1)
+        with identity_map():
+            forms = [PuppetForm(instance=puppet) for puppet in Puppet.objects.all()]
+        self.assertEqual([len(form.fields['secret_lover'].widget.choices) for form in forms], [2, 3])
+
+
+class CascadedChoicesTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def test_dependents(self):
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD, 'enemy': 2})
+        choices, invalidated = form.get_cascaded_dynamic_choices(['enemy'])
+        self.assertEqual(set(choices), set(['enemy', 'because_of']))
+        self.assertEqual(choices['because_of'], [('', '---------'), (2, 'Evil master (2)')])
+        self.assertEqual(invalidated, set())
+
+    def test_invalidated_value(self):
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD, 'enemy': 1})
+        choices, invalidated = form.get_cascaded_dynamic_choices(['enemy'])
+        self.assertEqual(invalidated, set(['enemy']))
+        self.assertEqual(choices['because_of'], [('', '---------')])
+
+
+class SearchableChoicesTests(TestCase):
+
+    def setUp(self):
+        self.tricks = [
+            Trick.objects.create(name=name, alignment=alignment) for name, alignment in [
+                ('Card trick', ALIGNMENT_GOOD), ('Coin trick', ALIGNMENT_GOOD),
+                ('Rope trick', ALIGNMENT_GOOD), ('Card fraud', ALIGNMENT_EVIL),
+            ]
+        ]
+
+    def test_selected_choices(self):
+        form = ShowForm(initial={'alignment': ALIGNMENT_GOOD, 'trick': self.tricks[1].pk})
+        field = form.fields['trick']
+        self.assertTrue(field.searchable)
+        self.assertEqual(field.widget.attrs['data-dynamic-choices-search'], 'true')
+        self.assertEqual(list(field.widget.choices), [('', '---------'), (self.tricks[1].pk, 'Coin trick')])
+
+    def test_no_selected_choice(self):
+        form = ShowForm(initial={'alignment': ALIGNMENT_GOOD})
+        self.assertEqual(list(form.fields['trick'].widget.choices), [('', '---------')])
+
+    def test_search_pages(self):
+        field = ShowForm(initial={'alignment': ALIGNMENT_GOOD}).fields['trick']
+        choices, cursor = field.search_choices()
+        self.assertEqual(choices, [(self.tricks[0].pk, 'Card trick'), (self.tricks[1].pk, 'Coin trick')])
+        self.assertEqual(cursor, self.tricks[1].pk)
+        choices, cursor = field.search_choices(cursor=cursor)
+        self.assertEqual(choices, [(self.tricks[2].pk, 'Rope trick')])
+        self.assertIsNone(cursor)
+
+    def test_search_term(self):
+        field = ShowForm(initial={'alignment': ALIGNMENT_GOOD}).fields['trick']
+        self.assertEqual(field.search_choices('card'), ([(self.tricks[0].pk, 'Card trick')], None))
+        self.assertEqual(field.search_choices('trick card'), ([(self.tricks[0].pk, 'Card trick')], None))
+
+    def test_validation(self):
+        form = ShowForm({'alignment': ALIGNMENT_GOOD, 'trick': self.tricks[3].pk})
+        self.assertFalse(form.is_valid())
+        self.assertIn('trick', form.errors)
+        form = ShowForm({'alignment': ALIGNMENT_GOOD, 'trick': self.tricks[2].pk})
+        self.assertTrue(form.is_valid())
+
+
+class LabelChoicesTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def setUp(self):
+        self.trick = Trick.objects.create(name='Card trick', alignment=ALIGNMENT_GOOD)
+        Trick.objects.create(name='Card fraud', alignment=ALIGNMENT_EVIL)
+
+    def set_choices_label(self, model, name, label):
+        field = model._meta.get_field(name)
+        original = field.choices_label
+        field.choices_label = label
+        self.addCleanup(setattr, field, 'choices_label', original)
+
+    def test_columns(self):
+        field = ShowForm(initial={'alignment': ALIGNMENT_GOOD, 'trick': self.trick.pk}).fields['trick']
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(field.search_choices(), ([(self.trick.pk, 'Card trick')], None))
+        select = context.captured_queries[0]['sql'].split(' FROM ')[0]
+        self.assertIn('"name"', select)
+        self.assertNotIn('"alignment"', select)
+
+    def test_grouped_choices(self):
+        self.set_choices_label(Enemy, 'enemy', ('alignment', 'id'))
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        with self.assertNumQueries(1):
+            self.assertEqual(list(form.fields['enemy'].widget.choices), [
+                ('', '---------'),
+                ('Evil', [(2, '0 2')]),
+                ('Neutral', []),
+            ])
+
+    def test_grouped_choices_ordered_model(self):
+        self.set_choices_label(Enemy, 'enemy', ('alignment',))
+        ordering = Puppet._meta.ordering
+        Puppet._meta.ordering = ['pk']
+        self.addCleanup(setattr, Puppet._meta, 'ordering', ordering)
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD})
+        with self.assertNumQueries(1):
+            self.assertEqual(list(form.fields['enemy'].widget.choices), [
+                ('', '---------'),
+                ('Evil', [(2, '0')]),
+                ('Neutral', []),
+            ])
+
+    def test_choices(self):
+        self.set_choices_label(Enemy, 'because_of', 'alignment')
+        form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD, 'enemy': 2})
+        self.assertEqual(list(form.fields['because_of'].widget.choices), [('', '---------'), (2, '0')])
+        self.assertEqual(len(form.fields['because_of'].widget.choices), 2)
+        with identity_map():
+            form = EnemyForm(initial={'puppet__alignment': ALIGNMENT_GOOD, 'enemy': 2})
+            self.assertEqual(list(form.fields['because_of'].widget.choices), [('', '---------'), (2, '0')])
+
+    @skipIf(django.VERSION < (1, 8), 'Expressions are only supported on Django 1.8+')
+    def test_expression(self):
+        from django.db.models.functions import Upper
+        self.set_choices_label(Show, 'trick', Upper('name'))
+        form = ShowForm(initial={'alignment': ALIGNMENT_GOOD, 'trick': self.trick.pk})
+        self.assertEqual(list(form.fields['trick'].widget.choices), [('', '---------'), (self.trick.pk, 'CARD TRICK')])
@@ -2,11 +2,27 @@ from __future__ import unicode_literals
 
 from django.core.exceptions import FieldError, ValidationError
 from django.db.models import Model
+from django.db.models.signals import post_save
 from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import translation
 
-from dynamic_choices.db.models import DynamicChoicesForeignKey
+from dynamic_choices.db.cache import get_tables
+from dynamic_choices.db.dependencies import get_dependency_graph
+from dynamic_choices.db.models import (
+    MISSING, ChoicesRelationshipResolver, DynamicChoicesForeignKey,
+    LazyInstanceData,
+)
+from dynamic_choices.db.query import (
+    GROUP_COLUMN, CompositeQuerySet, get_identity_map, identity_map,
+)
+from dynamic_choices.forms import DynamicModelForm
+from dynamic_choices.utils import get_cache
 
-from .models import ALIGNMENT_EVIL, ALIGNMENT_GOOD, Enemy, Master, Puppet
+from .models import (
+    ALIGNMENT_EVIL, ALIGNMENT_GOOD, ALIGNMENT_NEUTRAL, Apprentice, Dog, Enemy,
+    Marionette, Master, Puppet, Pupil, Stage, Trick,
+)
 
 
 class DefinitionValidationTest(SimpleTestCase):
@@ -45,6 +61,138 @@ class DynamicForeignKeyTests(TestCase):
         puppet = Puppet(master=self.good_master, alignment=ALIGNMENT_EVIL)
         self.assertRaises(ValidationError, puppet.full_clean)
 
+    def test_validation_queries(self):
+        """Make sure only the relationships the callback depends on are resolved"""
+        puppet = Puppet.objects.create(master=self.good_master, alignment=ALIGNMENT_GOOD)
+        puppet = Puppet.objects.get(pk=puppet.pk)
+        field = Puppet._meta.get_field('master')
+        with self.assertNumQueries(1):
+            field.validate(self.good_master.pk, puppet)
+
+    def test_validate_many(self):
+        field = Puppet._meta.get_field('master')
+        instances = [
+            Puppet(master=self.good_master, alignment=ALIGNMENT_GOOD),
+            Puppet(master=self.evil_master, alignment=ALIGNMENT_GOOD),
+            Puppet(master=self.evil_master, alignment=ALIGNMENT_EVIL),
+            Puppet(master_id=self.good_master.pk, alignment=ALIGNMENT_GOOD),
+            Puppet(alignment=ALIGNMENT_EVIL),
+        ]
+        with self.assertNumQueries(2):
+            errors = field.validate_many(instances)
+        self.assertEqual([error is None for error in errors], [True, False, True, True, True])
+        self.assertEqual(errors[1].code, 'invalid')
+
+    def test_validate_many_grouped_choices(self):
+        field = Enemy._meta.get_field('enemy')
+        good_puppet = Puppet.objects.create(master=self.good_master, alignment=ALIGNMENT_GOOD)
+        evil_puppet = Puppet.objects.create(master=self.evil_master, alignment=ALIGNMENT_EVIL)
+        instances = [
+            Enemy(puppet=good_puppet, enemy=evil_puppet),
+            Enemy(puppet=good_puppet, enemy=good_puppet),
+            Enemy(puppet=evil_puppet, enemy=good_puppet),
+        ]
+        with self.assertNumQueries(2):
+            errors = field.validate_many(instances)
+        self.assertEqual([error is None for error in errors], [True, False, True])
+        errors = field.validate_many(instances, batch_size=1)
+        self.assertEqual([error is None for error in errors], [True, False, True])
+
+    def test_validate_many_method_callback(self):
+        field = Pupil._meta.get_field('master')
+        instances = [
+            Pupil(master=self.good_master, level=ALIGNMENT_GOOD),
+            Pupil(master=self.evil_master, level=ALIGNMENT_EVIL),
+            Pupil(master=self.good_master, level=ALIGNMENT_EVIL),
+        ]
+        errors = field.validate_many(instances)
+        self.assertEqual([error is None for error in errors], [True, True, False])
+        for instance in instances[:2]:
+            instance.save()
+        errors = field.validate_many(instances[:2])
+        self.assertEqual([error is None for error in errors], [True, True])
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dynamic-choices-tests',
+    }
+})
+class CachedChoicesTests(TestCase):
+    class ApprenticeForm(DynamicModelForm):
+        class Meta:
+            model = Apprentice
+            fields = ('alignment', 'master')
+
+    def setUp(self):
+        get_cache('default').clear()
+        self.good_master = Master.objects.create(alignment=ALIGNMENT_GOOD)
+        self.evil_master = Master.objects.create(alignment=ALIGNMENT_EVIL)
+
+    def assertMasterChoices(self, choices, num_queries):
+        form = self.ApprenticeForm(initial={'alignment': ALIGNMENT_GOOD})
+        with self.assertNumQueries(num_queries):
+            self.assertEqual([choice for choice, _label in form.fields['master'].widget.choices], [''] + choices)
+
+    def test_rendering(self):
+        self.assertMasterChoices([self.good_master.pk], 1)
+        self.assertMasterChoices([self.good_master.pk], 0)
+        form = self.ApprenticeForm(initial={'alignment': ALIGNMENT_EVIL})
+        choices = [choice for choice, _label in form.fields['master'].widget.choices]
+        self.assertEqual(choices, ['', self.evil_master.pk])
+
+    def test_validation(self):
+        field = Apprentice._meta.get_field('master')
+        apprentice = Apprentice(alignment=ALIGNMENT_GOOD)
+        with self.assertNumQueries(1):
+            field.validate(self.good_master.pk, apprentice)
+        with self.assertNumQueries(0):
+            field.validate(self.good_master.pk, apprentice)
+            self.assertRaises(ValidationError, field.validate, self.evil_master.pk, apprentice)
+            errors = field.validate_many([
+                Apprentice(master=self.good_master, alignment=ALIGNMENT_GOOD),
+                Apprentice(master=self.evil_master, alignment=ALIGNMENT_GOOD),
+            ])
+        self.assertEqual([error is None for error in errors], [True, False])
+
+    def test_unsaved_instance_not_cached(self):
+        field = Pupil._meta.get_field('master')
+        field.validate(self.good_master.pk, Pupil(level=ALIGNMENT_GOOD))
+        field.validate(self.evil_master.pk, Pupil(level=ALIGNMENT_EVIL))
+        self.assertRaises(ValidationError, field.validate, self.good_master.pk, Pupil(level=ALIGNMENT_EVIL))
+
+    def test_language(self):
+        self.assertMasterChoices([self.good_master.pk], 1)
+        with translation.override('fr'):
+            self.assertMasterChoices([self.good_master.pk], 1)
+            self.assertMasterChoices([self.good_master.pk], 0)
+        self.assertMasterChoices([self.good_master.pk], 0)
+
+    def test_invalidation(self):
+        self.assertMasterChoices([self.good_master.pk], 1)
+        master = Master.objects.create(alignment=ALIGNMENT_GOOD)
+        self.assertMasterChoices([self.good_master.pk, master.pk], 1)
+        master.delete()
+        self.assertMasterChoices([self.good_master.pk], 1)
+        self.evil_master.alignment = ALIGNMENT_GOOD
+        self.evil_master.save()
+        self.assertMasterChoices([self.good_master.pk, self.evil_master.pk], 1)
+
+    def test_signals_senders(self):
+        self.assertMasterChoices([self.good_master.pk], 1)
+        self.assertTrue(post_save.has_listeners(Master))
+        self.assertFalse(post_save.has_listeners(Trick))
+
+    def test_joined_tables(self):
+        self.assertEqual(get_tables(Puppet.objects.all()), set(['dynamic_choices_puppet']))
+        self.assertEqual(get_tables(Puppet.objects.filter(master__alignment=ALIGNMENT_GOOD)), set([
+            'dynamic_choices_puppet', 'dynamic_choices_master'
+        ]))
+        self.assertEqual(get_tables(CompositeQuerySet([
+            Puppet.objects.all(), Puppet.objects.filter(friends__alignment=ALIGNMENT_GOOD)
+        ])), set(['dynamic_choices_puppet', 'dynamic_choices_puppet_friends']))
+
 
 class DynamicOneToOneFieldTests(TestCase):
     fixtures = ['dynamic_choices_test_data']
@@ -69,3 +217,243 @@ class DynamicOneToOneFieldTests(TestCase):
             ValidationError, self.good_puppet.full_clean,
             "Since the evil puppet secretly loves the good puppet the good puppet can only secretly love the bad one."
         )
+
+
+class ChoicesRelationshipResolutionTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def resolve(self, field, data):
+        return dict(
+            (resolver.descriptor, resolver.resolve(data))
+            for resolver in field._choices_relationship_resolvers
+        )
+
+    def test_direct_descriptor(self):
+        field = Enemy._meta.get_field('because_of')
+        self.assertEqual(self.resolve(field, {'enemy__alignment': '1'}), {'enemy__alignment': ALIGNMENT_GOOD})
+
+    def test_foreign_key_hop(self):
+        field = Enemy._meta.get_field('because_of')
+        self.assertEqual(self.resolve(field, {'enemy': ['2']}), {'enemy__alignment': ALIGNMENT_EVIL})
+        self.assertEqual(self.resolve(field, {'enemy': Puppet.objects.get(pk=1)}),
+                         {'enemy__alignment': ALIGNMENT_GOOD})
+
+    def test_foreign_key_descriptor(self):
+        resolver = ChoicesRelationshipResolver('puppet', [Enemy._meta.get_field('puppet')])
+        enemy = Enemy.objects.get(pk=1)
+        self.assertEqual(resolver.resolve(LazyInstanceData(enemy)), enemy.puppet_id)
+        enemy.puppet
+        self.assertEqual(resolver.resolve(LazyInstanceData(enemy)), enemy.puppet_id)
+        self.assertEqual(resolver.resolve({'puppet': enemy.puppet}), enemy.puppet_id)
+
+    def test_unresolvable(self):
+        field = Enemy._meta.get_field('because_of')
+        for data in ({}, {'enemy': None}, {'enemy': '1337'}, {'enemy__alignment': 'invalid'}):
+            self.assertIs(self.resolve(field, data)['enemy__alignment'], MISSING)
+
+    def test_chained_foreign_keys_single_query(self):
+        resolver = ChoicesRelationshipResolver('enemy__master__alignment', [
+            Enemy._meta.get_field('enemy'),
+            Puppet._meta.get_field('master'),
+            Master._meta.get_field('alignment'),
+        ])
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.resolve({'enemy': '2'}), ALIGNMENT_EVIL)
+        puppet = Puppet.objects.select_related('master').get(pk=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve({'enemy': puppet}), ALIGNMENT_GOOD)
+        puppet = Puppet.objects.get(pk=1)
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.resolve({'enemy': puppet}), ALIGNMENT_GOOD)
+
+
+class DependencyGraphTests(SimpleTestCase):
+    def test_relationships(self):
+        graph = get_dependency_graph(Puppet)
+        self.assertEqual(graph.relationships['alignment'], set(['master', 'friends']))
+        self.assertEqual(graph.relationships['id'], set(['friends']))
+        self.assertEqual(graph.requirements['secret_lover'], set())
+
+    def test_inherited_fields(self):
+        graph = get_dependency_graph(Marionette)
+        self.assertEqual(graph.relationships['alignment'], set(['master', 'friends']))
+
+        class MarionetteForm(DynamicModelForm):
+            class Meta:
+                model = Marionette
+                fields = ('alignment', 'master', 'strings')
+        self.assertEqual(MarionetteForm().get_dynamic_relationships(), {'alignment': set(['master'])})
+
+    def test_closure(self):
+        graph = get_dependency_graph(Enemy)
+        self.assertEqual(graph.dependents['puppet'], set(['enemy']))
+        self.assertEqual(graph.closure['puppet'], set(['enemy', 'because_of']))
+
+    def test_related_dependents(self):
+        graph = get_dependency_graph(Enemy)
+        self.assertEqual(graph.get_related_dependents('puppet'), {'alignment': set(['enemy'])})
+        self.assertEqual(graph.get_related_dependents('enemy'), {'alignment': set(['because_of'])})
+
+
+class IdentityMapTests(TestCase):
+    fixtures = ['dynamic_choices_test_data']
+
+    def test_activation(self):
+        self.assertIsNone(get_identity_map())
+        with identity_map() as active:
+            self.assertIs(get_identity_map(), active)
+            with identity_map() as nested:
+                self.assertIs(nested, active)
+            self.assertIs(get_identity_map(), active)
+        self.assertIsNone(get_identity_map())
+
+    def test_loaded_once(self):
+        with identity_map() as active:
+            with self.assertNumQueries(1):
+                puppet = active.get(Puppet, '1', ('master',))
+                self.assertIs(active.get(Puppet, 1), puppet)
+                self.assertIs(active.get(Master, 1), puppet.master)
+            with self.assertNumQueries(1):
+                self.assertIsNone(active.get(Puppet, 1337))
+                self.assertIsNone(active.get(Puppet, 1337))
+
+    def test_resolution(self):
+        field = Enemy._meta.get_field('because_of')
+        resolver = field._choices_relationship_resolvers[0]
+        with identity_map():
+            with self.assertNumQueries(1):
+                for _ in range(3):
+                    self.assertEqual(resolver.resolve({'enemy': '2'}), ALIGNMENT_EVIL)
+                    self.assertEqual(resolver.resolve({'enemy': 2}), ALIGNMENT_EVIL)
+
+
+class CompositeQuerySetTests(TestCase):
+    def setUp(self):
+        self.masters = [Master.objects.create(alignment=alignment) for alignment in (
+            ALIGNMENT_GOOD, ALIGNMENT_EVIL, ALIGNMENT_GOOD, ALIGNMENT_NEUTRAL
+        )]
+        self.queryset = CompositeQuerySet([
+            Master.objects.filter(alignment=ALIGNMENT_GOOD).order_by('-pk'),
+            Master.objects.none(),
+            Master.objects.exclude(alignment=ALIGNMENT_EVIL).order_by('-pk'),
+        ])
+
+    def test_iteration(self):
+        good, _evil, other_good, neutral = self.masters
+        with self.assertNumQueries(1):
+            masters = list(self.queryset.iterator())
+        self.assertEqual(masters, [other_good, good, neutral, other_good, good])
+        self.assertFalse(any(hasattr(master, GROUP_COLUMN) for master in masters))
+        with self.assertNumQueries(1):
+            self.assertEqual([group for group, _master in self.queryset.group_iterator()], [0, 0, 2, 2, 2])
+
+    def test_ordered_iteration(self):
+        good, evil, other_good = [Stage.objects.create(alignment=alignment) for alignment in (
+            ALIGNMENT_GOOD, ALIGNMENT_EVIL, ALIGNMENT_GOOD
+        )]
+        queryset = CompositeQuerySet([
+            Stage.objects.filter(alignment=ALIGNMENT_GOOD), Stage.objects.filter(alignment=ALIGNMENT_EVIL),
+        ])
+        with self.assertNumQueries(1):
+            stages = list(queryset.iterator())
+        self.assertEqual(stages, [other_good, good, evil])
+        self.assertFalse(any(hasattr(stage, "%s_order_0" % GROUP_COLUMN) for stage in stages))
+
+    def test_prefetch_related(self):
+        puppets = Puppet.objects.prefetch_related('friends')
+        queryset = CompositeQuerySet([puppets.filter(alignment=ALIGNMENT_GOOD), puppets.none()])
+        good = Puppet.objects.create(alignment=ALIGNMENT_GOOD, master=self.masters[0])
+        with self.assertNumQueries(2):
+            results = [puppet for puppet in queryset]
+        self.assertEqual(results, [good])
+        with self.assertNumQueries(0):
+            self.assertEqual(list(results[0].friends.all()), [])
+
+    def test_iteration_fallback(self):
+        good, _evil, other_good, neutral = self.masters
+        querysets = self.queryset.querysets
+        queryset = CompositeQuerySet([querysets[0].order_by('alignment', 'pk')] + list(querysets[1:]))
+        with self.assertNumQueries(2):
+            self.assertEqual(list(queryset.iterator()), [good, other_good, neutral, other_good, good])
+
+    def test_deferred_iteration(self):
+        with self.assertNumQueries(1):
+            masters = list(self.queryset.only('pk').iterator())
+        self.assertEqual([master.pk for master in masters], [master.pk for master in self.queryset])
+        with self.assertNumQueries(1):
+            self.assertEqual([master.pk for master in self.queryset.defer('alignment')[:2]],
+                             [self.masters[2].pk, self.masters[0].pk])
+
+    def test_values_list(self):
+        good, _evil, other_good, neutral = self.masters
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.queryset.values_list('pk', flat=True).iterator()),
+                             [other_good.pk, good.pk, neutral.pk, other_good.pk, good.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.queryset.values_list('alignment', 'pk').iterator())[1:3],
+                             [(ALIGNMENT_GOOD, good.pk), (ALIGNMENT_NEUTRAL, neutral.pk)])
+
+    def test_values_list_group_iterator(self):
+        good, _evil, other_good, neutral = self.masters
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.queryset.values_list('pk', 'alignment').group_iterator()), [
+                (0, (other_good.pk, ALIGNMENT_GOOD)), (0, (good.pk, ALIGNMENT_GOOD)),
+                (2, (neutral.pk, ALIGNMENT_NEUTRAL)), (2, (other_good.pk, ALIGNMENT_GOOD)),
+                (2, (good.pk, ALIGNMENT_GOOD)),
+            ])
+
+    def test_ordered_model_group_iterator(self):
+        good, evil, other_good = [Stage.objects.create(alignment=alignment) for alignment in (
+            ALIGNMENT_GOOD, ALIGNMENT_EVIL, ALIGNMENT_GOOD
+        )]
+        queryset = CompositeQuerySet([
+            Stage.objects.filter(alignment=ALIGNMENT_GOOD), Stage.objects.filter(alignment=ALIGNMENT_EVIL),
+        ])
+        with self.assertNumQueries(1):
+            self.assertEqual(list(queryset.values_list('pk', flat=True).group_iterator()), [
+                (0, other_good.pk), (0, good.pk), (1, evil.pk),
+            ])
+
+    def test_inherited_ordering_values_list(self):
+        rex = Dog.objects.create(name='Rex', size=2)
+        fido = Dog.objects.create(name='Fido', size=1)
+        queryset = CompositeQuerySet([Dog.objects.filter(size=2), Dog.objects.all()])
+        self.assertEqual(list(queryset.values_list('size', flat=True)), [2, 1, 2])
+        self.assertEqual(list(queryset), [rex, fido, rex])
+
+    def test_slicing(self):
+        good, _evil, other_good, neutral = self.masters
+        with self.assertNumQueries(1):
+            self.assertEqual(self.queryset[1:4], [good, neutral, other_good])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.queryset[2], neutral)
+        self.assertEqual(self.queryset[3:], [other_good, good])
+        self.assertEqual(self.queryset.values_list('pk', flat=True)[::2], [other_good.pk, neutral.pk, good.pk])
+        with self.assertRaises(IndexError):
+            self.queryset[5]
+
+    def test_slicing_fallback(self):
+        good, _evil, other_good, neutral = self.masters
+        queryset = CompositeQuerySet(qs.extra(select={'foo': '1'}) for qs in self.queryset.querysets)
+        self.assertEqual(queryset[1:4], [good, neutral, other_good])
+        self.assertEqual(queryset[2], neutral)
+        self.assertEqual(queryset[3:], [other_good, good])
+
+    def test_count(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.queryset.count(), 5)
+        self.assertEqual(len(self.queryset), 5)
+        self.assertEqual(CompositeQuerySet([Master.objects.none()]).count(), 0)
+
+    def test_exists(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.queryset.exists())
+        with self.assertNumQueries(1):
+            self.assertFalse(self.queryset.filter(alignment=ALIGNMENT_EVIL).exists())
+
+    def test_get(self):
+        good = self.masters[0]
+        with self.assertNumQueries(1):
+            self.assertEqual(self.queryset.get(pk=good.pk), good)
+        with self.assertRaises(Master.DoesNotExist):
+            self.queryset.get(pk=self.masters[1].pk)